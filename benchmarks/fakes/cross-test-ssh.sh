@@ -0,0 +1,17 @@
+#!/bin/sh
+# minimal stand-in for scripts/cross-test-ssh.sh of glibc
+
+ssh=ssh
+timeoutfactor=1
+while [ $# -gt 0 ]; do
+    case "$1" in
+        --ssh) ssh=$2; shift 2 ;;
+        --timeoutfactor) timeoutfactor=$2; shift 2 ;;
+        --allow-time-setting) shift ;;
+        *) break ;;
+    esac
+done
+
+host=$1
+shift
+exec $ssh "$host" "cd '$PWD' && timeout $((20 * timeoutfactor)) $*"
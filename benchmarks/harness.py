@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+
+import argparse
+import json
+import logging
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from testsuite.glibctestsuite import GlibcTestSuite, GlibcTestSuiteError
+from utils import mkdir
+from utils.ssh import SSHConnection, SSHConnectionError
+
+FAKES_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'fakes')
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+RESULTS_PATH = os.path.join(
+    os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache')),
+    'arc-gnu-testsuite', 'harness-benchmarks.jsonl')
+TEST_NAME = os.path.join('bench', 'tst-true')
+
+
+def job_counts(value):
+    try:
+        counts = [int(count) for count in value.split(',')]
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'invalid job counts: \'{value}\'')
+    if not counts or min(counts) < 1:
+        raise argparse.ArgumentTypeError(f'invalid job counts: \'{value}\'')
+    return counts
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(
+        description='measure the overhead of the harness with local '
+                    'stand-ins for the emulator, SSH and NFS')
+    logging.basicConfig(stream=sys.stderr, format='%(levelname)s: %(message)s',
+                        level=logging.INFO)
+
+    parser.add_argument('--glibc-dir',
+                        type=str,
+                        help='glibc directory to take cross-test-ssh.sh '
+                             'from(a minimal stand-in)')
+
+    commands = 200
+    parser.add_argument('--commands',
+                        type=int,
+                        default=commands,
+                        help=f'commands per latency measurement({commands})')
+
+    tests = 200
+    parser.add_argument('--tests',
+                        type=int,
+                        default=tests,
+                        help=f'tests per throughput measurement({tests})')
+
+    test_jobs = '1,2,4,8'
+    parser.add_argument('--test-jobs',
+                        type=job_counts,
+                        default=job_counts(test_jobs),
+                        help=f'comma separated --test-jobs values({test_jobs})')
+
+    repeat = 3
+    parser.add_argument('--repeat',
+                        type=int,
+                        default=repeat,
+                        help=f'setups and teardowns to measure({repeat})')
+
+    parser.add_argument('--no-ssh-multiplexing',
+                        help='measure without an SSH master connection',
+                        action='store_true')
+
+    parser.add_argument('--results',
+                        type=str,
+                        default=RESULTS_PATH,
+                        help=f'file the results are appended to({RESULTS_PATH})')
+
+    return parser.parse_args()
+
+
+def create_glibc_dir(args, root):
+    glibc_dir = os.path.join(root, 'glibc')
+    mkdir(os.path.join(glibc_dir, 'scripts'))
+    cross_test_ssh = os.path.join(FAKES_DIR, 'cross-test-ssh.sh')
+    if args.glibc_dir:
+        cross_test_ssh = os.path.join(args.glibc_dir, 'scripts',
+                                      'cross-test-ssh.sh')
+    shutil.copy(cross_test_ssh, os.path.join(glibc_dir, 'scripts'))
+
+    test = os.path.join(glibc_dir, 'build', TEST_NAME)
+    mkdir(os.path.dirname(test))
+    with open(test, 'w') as test_file:
+        test_file.write('#!/bin/sh\n\nexit 0\n')
+    os.chmod(test, 0o755)
+    return glibc_dir
+
+
+def create_testsuite(args, glibc_dir):
+    return GlibcTestSuite('',
+                          False,
+                          1,
+                          glibc_dir,
+                          os.path.join(FAKES_DIR, 'qemu'),
+                          unfs_path=os.path.join(FAKES_DIR, 'unfsd'),
+                          cpu='fake',
+                          ssh_host='127.0.0.1',
+                          qemu_path=os.path.join(FAKES_DIR, 'qemu'),
+                          run_check=False,
+                          run_xcheck=False,
+                          ssh_multiplexing=not args.no_ssh_multiplexing)
+
+
+def mean_time(function, count):
+    timings = []
+    for _ in range(count):
+        start = time.monotonic()
+        function()
+        timings.append(time.monotonic() - start)
+    return statistics.mean(timings)
+
+
+def run_test(testsuite, target):
+    command = [target.test_wrapper[0],
+               os.path.join(testsuite.build_dir, TEST_NAME)]
+    subprocess.run(command, cwd=testsuite.build_dir, check=True,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def measure_setup(args, glibc_dir):
+    setups, teardowns = [], []
+    for _ in range(args.repeat):
+        testsuite = create_testsuite(args, glibc_dir)
+        start = time.monotonic()
+        try:
+            testsuite.start()
+            setups.append(time.monotonic() - start)
+        finally:
+            start = time.monotonic()
+            testsuite.stop()
+            teardowns.append(time.monotonic() - start)
+    return {'setup': statistics.mean(setups),
+            'teardown': statistics.mean(teardowns)}
+
+
+def measure_commands(args, testsuite, target):
+    ssh = SSHConnection(hostname=target.hostname, port=target.port)
+    ssh_command = [target.ssh_cmd, f'root@{target.hostname}', 'true']
+    try:
+        return {
+            'console run': mean_time(lambda: target.emulator.run('true'),
+                                     args.commands),
+            'ssh run': mean_time(lambda: ssh.run('true'), args.commands),
+            'ssh wrapper': mean_time(
+                lambda: subprocess.run(ssh_command, check=True),
+                args.commands),
+            'test dispatch': mean_time(lambda: run_test(testsuite, target),
+                                       args.commands)
+        }
+    finally:
+        ssh.close()
+
+
+def measure_throughput(args, testsuite, target):
+    throughput = {}
+    for jobs in args.test_jobs:
+        start = time.monotonic()
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            for future in [executor.submit(run_test, testsuite, target)
+                           for _ in range(args.tests)]:
+                future.result()
+        throughput[str(jobs)] = args.tests / (time.monotonic() - start)
+    return throughput
+
+
+def run_benchmarks(args, root):
+    glibc_dir = create_glibc_dir(args, root)
+    results = measure_setup(args, glibc_dir)
+
+    testsuite = create_testsuite(args, glibc_dir)
+    try:
+        testsuite.start()
+        target = testsuite.targets[0]
+        results.update(measure_commands(args, testsuite, target))
+        results['throughput'] = measure_throughput(args, testsuite, target)
+    finally:
+        testsuite.stop()
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'],
+                              cwd=REPO_DIR, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def load_previous(path, ssh_multiplexing):
+    previous = None
+    try:
+        with open(path) as results_file:
+            for line in results_file:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if record.get('ssh_multiplexing') == ssh_multiplexing:
+                    previous = record
+    except FileNotFoundError:
+        pass
+    return previous
+
+
+def save(path, record):
+    mkdir(os.path.dirname(os.path.abspath(path)))
+    with open(path, 'a') as results_file:
+        results_file.write(json.dumps(record, separators=(',', ':')) + '\n')
+
+
+def print_results(results, previous):
+    old = previous['results'] if previous else {}
+    title = f'previous({previous["commit"]})' if previous else ''
+    print(f'{"measurement":<20}{"current":>14}{title:>20}')
+
+    for name in ('setup', 'teardown', 'console run', 'ssh run', 'ssh wrapper',
+                 'test dispatch'):
+        line = f'{name:<20}{results[name] * 1e3:>12.2f}ms'
+        if name in old:
+            line += f'{old[name] * 1e3:>18.2f}ms'
+        print(line)
+
+    for jobs, rate in results['throughput'].items():
+        name = f'throughput -j{jobs}'
+        line = f'{name:<20}{rate:>10.1f}/sec'
+        if jobs in old.get('throughput', {}):
+            line += f'{old["throughput"][jobs]:>16.1f}/sec'
+        print(line)
+
+
+def main():
+    args = parse_arguments()
+
+    # the SSH wrappers and pxssh find the stand-in ssh first
+    os.environ['PATH'] = FAKES_DIR + os.pathsep + os.environ['PATH']
+    root = tempfile.mkdtemp(prefix='harness-bench-')
+    try:
+        results = run_benchmarks(args, root)
+    except (GlibcTestSuiteError, SSHConnectionError,
+            subprocess.CalledProcessError) as err:
+        logging.error(err)
+        return 1
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+    ssh_multiplexing = not args.no_ssh_multiplexing
+    previous = load_previous(args.results, ssh_multiplexing)
+    record = {
+        'commit': git_commit(),
+        'time': time.time(),
+        'ssh_multiplexing': ssh_multiplexing,
+        'results': results
+    }
+    save(args.results, record)
+    print_results(results, previous)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
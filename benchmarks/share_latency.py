@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+
+import argparse
+import logging
+import os
+import sys
+import time
+
+from testsuite.glibctestsuite import GlibcTestSuite, GlibcTestSuiteError, \
+    SHARES
+from utils.ssh import SSHConnection, SSHConnectionError
+
+# shell builtins only, so that the loops measure the share and not fork/exec;
+# the empty loop is subtracted from the others
+OPERATIONS = [
+    ('loop', ':'),
+    ('create', 'echo x > f$i'),
+    ('stat', '[ -e f$i ]'),
+    ('read', 'read line < f$i'),
+    ('append', 'echo x >> f$i'),
+    ('remove', 'rm f$i')
+]
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(
+        description='compare file access latency of the glibc directory '
+                    'shares of QEMU guests')
+    logging.basicConfig(stream=sys.stderr, format='%(levelname)s: %(message)s',
+                        level=logging.INFO)
+
+    parser.add_argument('--glibc-dir',
+                        type=str,
+                        required=True,
+                        help='path to glibc directory')
+
+    parser.add_argument('--kernel',
+                        type=str,
+                        required=True,
+                        help='path to kernel')
+
+    parser.add_argument('--cpu',
+                        type=str,
+                        required=True,
+                        help='processor to emulate')
+
+    parser.add_argument('--qemu-path',
+                        type=str,
+                        required=True,
+                        help='path to QEMU emulator')
+
+    parser.add_argument('--qemu-extra-opts',
+                        type=str,
+                        help='additional QEMU options')
+
+    parser.add_argument('--unfs',
+                        type=str,
+                        help='Path to unfs3(required for nfs share)')
+
+    parser.add_argument('--virtiofsd-path',
+                        type=str,
+                        help='path to virtiofsd(from PATH)')
+
+    parser.add_argument('--share',
+                        choices=SHARES,
+                        action='append',
+                        help='share to measure, can be repeated(all)')
+
+    files = 200
+    parser.add_argument('--files',
+                        type=int,
+                        default=files,
+                        help=f'number of files per operation({files})')
+
+    return parser.parse_args()
+
+
+def measure(ssh, bench_dir, files):
+    ssh.run(f'mkdir -p {bench_dir} && cd {bench_dir} && rm -f f*')
+
+    # every command runs in a new shell of the agent
+    timings = {}
+    for name, command in OPERATIONS:
+        start = time.monotonic()
+        ssh.run(f'cd {bench_dir} && '
+                f'for i in $(seq {files}); do {command}; done', timeout=600,
+                check=False)
+        timings[name] = time.monotonic() - start
+
+    ssh.run(f'rmdir {bench_dir}', check=False)
+
+    loop = timings.pop('loop')
+    return {name: max(0.0, timing - loop) / files
+            for name, timing in timings.items()}
+
+
+def run_share(args, share):
+    testsuite = GlibcTestSuite('',
+                               False,
+                               1,
+                               args.glibc_dir,
+                               args.kernel,
+                               unfs_path=args.unfs,
+                               cpu=args.cpu,
+                               qemu_path=args.qemu_path,
+                               qemu_extra_opts=args.qemu_extra_opts,
+                               run_check=False,
+                               run_xcheck=False,
+                               share=share,
+                               virtiofsd_path=args.virtiofsd_path)
+    try:
+        testsuite.start()
+        target = testsuite.targets[0]
+        ssh = SSHConnection(hostname=target.hostname, port=target.port)
+        try:
+            return measure(ssh,
+                           os.path.join(testsuite.build_dir, 'share-latency'),
+                           args.files)
+        finally:
+            ssh.close()
+    finally:
+        testsuite.stop()
+
+
+def main():
+    args = parse_arguments()
+
+    latencies = {}
+    for share in args.share or SHARES:
+        if share == 'nfs' and not args.unfs:
+            logging.warning('skipping nfs share, --unfs is not given')
+            continue
+
+        logging.info('measuring %s share', share)
+        try:
+            latencies[share] = run_share(args, share)
+        except (GlibcTestSuiteError, SSHConnectionError) as err:
+            logging.error('%s share: %s', share, err)
+
+    if not latencies:
+        return 1
+
+    names = [name for name, _ in OPERATIONS[1:]]
+    print(f'{"share":<10}' + ''.join(f'{name:>10}' for name in names))
+    for share, latency in latencies.items():
+        print(f'{share:<10}' +
+              ''.join(f'{latency[name] * 1e6:>8.0f}us' for name in names))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
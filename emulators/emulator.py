@@ -1,8 +1,12 @@
 import abc
 import logging
 import pexpect
+import re
+import secrets
 from abc import ABC
 from pexpect import ExceptionPexpect
+from utils.console_log import ConsoleLog
+from utils.trace import traced
 
 
 class EmulatorError(Exception):
@@ -28,7 +32,7 @@ class Emulator(ABC):
 
         logging.info('%s starting with: %s %s', self.name(), self.command, ' '.join(args))
         if log_path:
-            self.logfile = open(log_path, "w")
+            self.logfile = ConsoleLog(log_path)
             logging.info('%s log will be saved: %s', self.name(), log_path)
 
         try:
@@ -46,6 +50,7 @@ class Emulator(ABC):
     def name(cls) -> str:
         pass
 
+    @traced('login', 'emulator')
     def login(self,
               user='root',
               password=None,
@@ -68,29 +73,38 @@ class Emulator(ABC):
         self.run('dmesg -n 1')
 
     def run(self, cmd, timeout=-1, check=False):
-        exitcode, output = 0, ''
+        # the exit code is printed after the output with a nonce, which the
+        # echo of the command line doesn't contain as it's split in two, so
+        # that a prompt in the output can't end the command early
+        nonce = secrets.token_hex(8)
+        marker = re.compile(f'\r?\n{nonce} (\\d+)\r?\n')
+        exitcode, output = 1, []
         try:
-            self.emulator.sendline(cmd)
-            self.emulator.expect(self.prompt, timeout=timeout)
+            self.emulator.sendline(f'{cmd}; printf \'\\n%s%s %d\\n\' '
+                                   f'{nonce[:8]} {nonce[8:]} $?')
+            self.emulator.expect(marker, timeout=timeout)
+            exitcode = int(self.emulator.match.group(1))
             output = self.emulator.before.replace(
                 '\r\r', '\r').splitlines()[1:]
-
-            self.emulator.sendline('echo $?')
             self.emulator.expect(self.prompt)
         except ExceptionPexpect:
-            EmulatorError(exitcode, cmd)
-
-        result = self.emulator.before.splitlines()
-        try:
-            exitcode = int(result[-1])
-        except ValueError:
-            exitcode = 1
+            pass
 
         if check and exitcode:
-            raise EmulatorError(exitcode, cmd)
+            raise EmulatorCalledProcessError(exitcode, cmd)
         return output, exitcode
 
+    def read_console(self, timeout=1):
+        try:
+            return self.emulator.read_nonblocking(size=4096, timeout=timeout)
+        except pexpect.TIMEOUT:
+            return ''
+        except ExceptionPexpect:
+            raise EmulatorError(f'{self.name()} console was closed')
+
     def stop(self):
         if self.emulator is None:
             return
         self.emulator.terminate(force=True)
+        if self.logfile is not None:
+            self.logfile.close()
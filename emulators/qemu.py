@@ -1,7 +1,66 @@
-from emulators.emulator import Emulator
+import logging
+import os
+import shlex
+import shutil
+import socket
+import tempfile
+import time
+from emulators.emulator import Emulator, EmulatorError
+from pexpect import ExceptionPexpect
 from typing import List, Optional
 
 
+class QemuMonitor:
+    PROMPT = b'(qemu) '
+
+    def __init__(self, path: str, timeout: int = 30):
+        self.path = path
+        self.timeout = timeout
+        self.sock = None
+
+    def _connect(self):
+        deadline = time.monotonic() + self.timeout
+        while True:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                sock.connect(self.path)
+                break
+            except OSError as err:
+                sock.close()
+                if time.monotonic() > deadline:
+                    raise EmulatorError(f'Cannot connect to QEMU monitor: {err}')
+                time.sleep(0.1)
+
+        sock.settimeout(self.timeout)
+        self.sock = sock
+        self._read_until_prompt()
+
+    def _read_until_prompt(self):
+        data = b''
+        while not data.endswith(self.PROMPT):
+            chunk = self.sock.recv(4096)
+            if not chunk:
+                raise EmulatorError('QEMU monitor connection was closed')
+            data += chunk
+        return data[:-len(self.PROMPT)].decode(errors='replace')
+
+    def command(self, cmd: str) -> str:
+        try:
+            if self.sock is None:
+                self._connect()
+            self.sock.sendall(cmd.encode() + b'\n')
+            output = self._read_until_prompt()
+        except OSError as err:
+            raise EmulatorError(f'QEMU monitor command \'{cmd}\' failed: {err}')
+        # the monitor echoes the command back before its output
+        return '\n'.join(output.splitlines()[1:])
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+
 class QemuEmulator(Emulator):
     def __init__(self,
                  qemu_path: str,
@@ -9,10 +68,14 @@ class QemuEmulator(Emulator):
                  kernel: str,
                  kernel_cmdline: Optional[List[str]] = None,
                  prompt: str = '# ',
-                 log_path: Optional[str] = None):
+                 log_path: Optional[str] = None,
+                 monitor: bool = False,
+                 incoming: Optional[str] = None):
         self.qemu_path = qemu_path
         self.log_path = log_path
         self.prompt = prompt
+        self.monitor_dir = None
+        self.monitor = None
 
         command = qemu_path
         args = ['-nographic', '-display', 'none']
@@ -27,8 +90,70 @@ class QemuEmulator(Emulator):
         if kernel_cmdline:
             args += ['-append', ' '.join(kernel_cmdline)]
 
+        if monitor or incoming:
+            self.monitor_dir = tempfile.mkdtemp(prefix='qemu-monitor-')
+            monitor_path = os.path.join(self.monitor_dir, 'monitor')
+            args += ['-monitor', f'unix:{monitor_path},server,nowait']
+            self.monitor = QemuMonitor(monitor_path)
+
+        if incoming:
+            args += ['-incoming', f'exec:cat {shlex.quote(incoming)}']
+
         super().__init__(command, args, env, prompt, log_path)
 
     @classmethod
     def name(cls) -> str:
         return 'qemu'
+
+    def _wait_migration(self, timeout):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            info = self.monitor.command('info migrate')
+            if 'Migration status: completed' in info:
+                return
+            if 'Migration status: failed' in info:
+                raise EmulatorError(f'QEMU migration failed: {info}')
+            time.sleep(0.5)
+        raise EmulatorError('QEMU migration timed out')
+
+    def save_state(self, path: str, timeout: int = 600):
+        if self.monitor is None:
+            raise EmulatorError('QEMU monitor is not enabled')
+
+        state_path = f'{path}.tmp'
+        logging.info('%s saving VM state: %s', self.name(), path)
+        self.monitor.command('stop')
+        try:
+            self.monitor.command(
+                f'migrate -d "exec:cat > {shlex.quote(state_path)}"')
+            self._wait_migration(timeout)
+            os.replace(state_path, path)
+        finally:
+            if os.path.exists(state_path):
+                os.unlink(state_path)
+            self.monitor.command('cont')
+
+    def resume(self, timeout: int = 600):
+        if self.monitor is None:
+            raise EmulatorError('QEMU monitor is not enabled')
+
+        deadline = time.monotonic() + timeout
+        while 'running' not in self.monitor.command('info status'):
+            if time.monotonic() > deadline:
+                raise EmulatorError('Restored VM does not run')
+            time.sleep(0.5)
+
+        self.emulator.sendline('')
+        try:
+            self.emulator.expect(self.prompt, timeout=timeout)
+        except ExceptionPexpect:
+            raise EmulatorError('Restored VM does not respond')
+        self.run('date -u -s "{}"'.format(
+            time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime())))
+
+    def stop(self):
+        if self.monitor is not None:
+            self.monitor.close()
+        super().stop()
+        if self.monitor_dir:
+            shutil.rmtree(self.monitor_dir, ignore_errors=True)
@@ -0,0 +1,64 @@
+import fnmatch
+from emulators.emulator import EmulatorError
+from shutil import which
+from typing import Dict, List, Optional
+
+
+class QemuUserEmulator:
+    def __init__(self,
+                 qemu_path: Optional[str],
+                 sysroot: str,
+                 cpu: Optional[str] = None,
+                 allow: Optional[List[str]] = None,
+                 deny: Optional[List[str]] = None):
+
+        if qemu_path is None:
+            qemu_path = which('qemu-arc')
+            if qemu_path is None:
+                raise EmulatorError('QEMU user mode emulator was not found')
+
+        self.qemu_path = qemu_path
+        self.sysroot = sysroot
+        self.cpu = cpu
+        self.allow = allow or []
+        self.deny = deny or []
+
+    @classmethod
+    def name(cls) -> str:
+        return 'qemu-user'
+
+    def config(self) -> Dict:
+        return {
+            'qemu_path': self.qemu_path,
+            'sysroot': self.sysroot,
+            'cpu': self.cpu,
+            'allow': self.allow,
+            'deny': self.deny
+        }
+
+    def accepts(self, test: str) -> bool:
+        if self.allow and not any(fnmatch.fnmatch(test, pattern)
+                                  for pattern in self.allow):
+            return False
+        return not any(fnmatch.fnmatch(test, pattern) for pattern in self.deny)
+
+    def command(self,
+                args: List[str],
+                env: Optional[List[str]] = None,
+                unset: Optional[List[str]] = None,
+                ignore_environment: bool = False) -> List[str]:
+        command = [self.qemu_path, '-L', self.sysroot]
+        # the target gets the environment of QEMU
+        if ignore_environment:
+            command = ['env', '-i'] + command
+
+        if self.cpu:
+            command += ['-cpu', self.cpu]
+
+        for name in unset or []:
+            command += ['-U', name]
+
+        for assignment in env or []:
+            command += ['-E', assignment]
+
+        return command + args
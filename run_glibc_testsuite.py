@@ -5,8 +5,17 @@ import logging
 import multiprocessing
 import os
 import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from shutil import which
 
-from testsuite.glibctestsuite import GlibcTestSuite, GlibcTestSuiteError
+from testsuite.glibctestsuite import GlibcTestSuite, GlibcTestSuiteError, \
+    SHARES
+from testsuite.matrix import MatrixError, comparison_table, load_matrix
+from testsuite.rundb import RunDatabase, RunDatabaseError
+from utils import mkdir
+from utils.trace import tracer
 
 
 def dir_path(path):
@@ -22,6 +31,17 @@ def file_path(path):
     raise argparse.ArgumentTypeError(f'file path doesn\'t exist: \'{path}\'')
 
 
+CACHE_DIR = os.path.join(
+    os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache')),
+    'arc-gnu-testsuite')
+RUN_DB = os.path.join(CACHE_DIR, 'runs.db')
+# options which get the name of the configuration in a matrix run
+MATRIX_FILES = ('progress_file', 'json_report', 'junit_report',
+                'duration_history')
+SERVER_SOCKET = os.path.join(tempfile.gettempdir(),
+                             f'glibc-guests-{os.getuid()}.sock')
+
+
 def parse_arguments():
     parser = argparse.ArgumentParser()
     logging.basicConfig(stream=sys.stderr, format='%(levelname)s: %(message)s',
@@ -71,6 +91,41 @@ def parse_arguments():
                        type=str,
                        help='additional QEMU options')
 
+    group.add_argument('--qemu-boot-snapshot',
+                       help='restore QEMU from a saved logged-in VM state',
+                       action='store_true')
+
+    group.add_argument('--qemu-snapshot-dir',
+                       type=str,
+                       default=CACHE_DIR,
+                       help=f'directory for QEMU VM states({CACHE_DIR})')
+
+    group.add_argument('--qemu-memory',
+                       type=str,
+                       help='guest memory size(1G for virtiofs share)')
+
+    group.add_argument('--auto-tune',
+                       help='size guest CPUs, memory and test jobs to '
+                            'the host',
+                       action='store_true')
+
+    group = parser.add_argument_group('QEMU user mode options')
+    group.add_argument('--qemu-user-path',
+                       type=file_path,
+                       help='path to QEMU user mode emulator')
+
+    group.add_argument('--qemu-user-allow',
+                       type=file_path,
+                       help='tests to run in QEMU user mode(all)')
+
+    deny_list = os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                             'support', 'qemu-user', 'deny.list')
+    group.add_argument('--qemu-user-deny',
+                       type=file_path,
+                       default=deny_list,
+                       help='tests to run on the system emulator'
+                            '(support/qemu-user/deny.list)')
+
     group = parser.add_argument_group('nSIM options')
     group.add_argument('--nsim-path',
                        type=file_path,
@@ -82,14 +137,19 @@ def parse_arguments():
 
     group.add_argument('--nsim-ifname',
                        type=file_path,
-                       help='nSIM network interface name')
+                       help='nSIM network interface name, or comma '
+                            'separated TAP pool for --emulators')
+
+    group.add_argument('--nsim-create-taps',
+                       help='create the missing TAP interfaces of the pool',
+                       action='store_true')
 
     group = parser.add_argument_group('build options')
     cpu_count = multiprocessing.cpu_count()
     group.add_argument('--build-jobs',
                        type=int,
                        default=cpu_count,
-                       help=f'number of jobs to build tests({cpu_count})')
+                       help=f'number of jobs to build glibc and tests({cpu_count})')
 
     build_flags = '-O2'
     group.add_argument('--cflags',
@@ -102,17 +162,64 @@ def parse_arguments():
                        default=os.environ.get('CXXFLAGS', build_flags),
                        help=f'CXXFLAGS options({build_flags})')
 
+    group.add_argument('--ccache',
+                       help='compile glibc and tests with ccache',
+                       action='store_true')
+
+    group.add_argument('--force',
+                       help='run configure, build and install even if '
+                            'their inputs are unchanged',
+                       action='store_true')
+
     group = parser.add_argument_group('SSH options')
     ssh_hostname = '127.0.0.1'
     group.add_argument('--ssh-host',
                        type=str,
                        default=ssh_hostname,
-                       help=f'target ssh hostname({ssh_hostname})')
+                       help='target ssh hostname, comma separated list or '
+                            f'inventory file of host[:port]({ssh_hostname})')
 
     group.add_argument('--ssh-port',
                        type=int,
                        help='target ssh port')
 
+    group.add_argument('--no-ssh-multiplexing',
+                       help='open a new SSH connection for every test',
+                       action='store_true')
+
+    group = parser.add_argument_group('share options')
+    share = 'nfs'
+    group.add_argument('--share',
+                       choices=SHARES,
+                       default=share,
+                       help=f'how glibc directory is shared with QEMU({share})')
+
+    group.add_argument('--virtiofsd-path',
+                       type=file_path,
+                       help='path to virtiofsd(from PATH)')
+
+    group = parser.add_argument_group('guest server options')
+    group.add_argument('--serve',
+                       help='boot and mount the guests and lease them to '
+                            'other runs',
+                       action='store_true')
+
+    group.add_argument('--server',
+                       help='run tests on guests leased from --serve',
+                       action='store_true')
+
+    group.add_argument('--server-socket',
+                       type=str,
+                       default=SERVER_SOCKET,
+                       help=f'Unix socket of the guest server({SERVER_SOCKET})')
+
+    idle_timeout = 1800
+    group.add_argument('--idle-timeout',
+                       type=int,
+                       default=idle_timeout,
+                       help='seconds without leases after which the server '
+                            f'stops({idle_timeout})')
+
     group = parser.add_argument_group('NFS options')
     group.add_argument('--unfs',
                        type=file_path,
@@ -128,15 +235,71 @@ def parse_arguments():
                        type=int,
                        default=timeout,
                        help=f'TIMEOUTAFACTOR on the remote machine({timeout})')
+    group.add_argument('--adaptive-timeouts',
+                       help='lower TIMEOUTFACTOR of tests from their '
+                            'durations in the history',
+                       action='store_true')
+
     group.add_argument('--test-jobs',
                        type=int,
                        default=1,
                        help='number of jobs to run tests(1)')
 
+    group.add_argument('--emulators',
+                       type=int,
+                       default=1,
+                       help='number of emulators to run tests on(1)')
+
+    group.add_argument('--schedule-subdirs',
+                       help='run subdirs longest first, two at a time '
+                            'sharing --test-jobs',
+                       action='store_true')
+
     group.add_argument('--subdir',
                        type=str,
                        help='testing only a subset of tests(optional)')
 
+    group.add_argument('--json-report',
+                       type=str,
+                       help='JSON test report(<build dir>/results.json)')
+
+    group.add_argument('--junit-report',
+                       type=str,
+                       help='JUnit XML test report(<build dir>/results.xml)')
+
+    group.add_argument('--duration-history',
+                       type=str,
+                       help='test durations of previous runs'
+                            '(<build dir>/durations.json)')
+
+    group.add_argument('--progress-file',
+                       type=str,
+                       help='JSON file updated with the progress of the '
+                            'tests(optional)')
+
+    group.add_argument('--run-db',
+                       type=str,
+                       default=RUN_DB,
+                       help=f'SQLite database of the test runs({RUN_DB})')
+
+    group.add_argument('--no-run-db',
+                       help='don\'t record the run in the run database',
+                       action='store_true')
+
+    group.add_argument('--rerun-failed',
+                       help='rerun only failed and unsupported tests of the '
+                            'previous run',
+                       action='store_true')
+
+    group.add_argument('--stage-tests',
+                       help='copy test programs and libraries to tmpfs on '
+                            'the targets',
+                       action='store_true')
+
+    group.add_argument('--watchdog',
+                       help='restart failed guests and resume the tests',
+                       action='store_true')
+
     group.add_argument('--allow-time-setting',
                        help='set GLIBC_TEST_ALLOW_TIME_SETTING env variable',
                        action='store_true')
@@ -153,6 +316,19 @@ def parse_arguments():
     group.add_argument('--xcheck-only',
                        help='run xtests only',
                        action='store_true')
+    parser.add_argument('--overlap-boot',
+                        help='start NFS server and emulators while glibc '
+                             'is being built',
+                        action='store_true')
+    parser.add_argument('--matrix',
+                        type=file_path,
+                        help='JSON list of configurations to build and test '
+                             'at the same time')
+    parser.add_argument('--trace',
+                        type=str,
+                        help='Chrome trace of the run phases'
+                             '(<build dir>/trace.json, '
+                             f'{CACHE_DIR}/matrix-trace.json with --matrix)')
     parser.add_argument('--verbose',
                         help='enable verbose output',
                         action='store_true')
@@ -160,68 +336,319 @@ def parse_arguments():
     return parser.parse_args()
 
 
-def main():
-    args = parse_arguments()
+def write_trace(path):
+    for line in tracer.summary():
+        logging.info(line)
 
-    build_only = args.build_only
-    check_only = args.check_only
-    xcheck_only = args.xcheck_only
-    toolchain_path = args.toolchain_path
-    cflags = args.cflags
-    cxxflags = args.cxxflags
+    try:
+        mkdir(os.path.dirname(path))
+        tracer.write(path)
+        logging.info('trace saved: %s', path)
+    except OSError as err:
+        logging.warning('Failed to save trace: %s', err)
 
+
+def create_env(args):
     env = {}
-    if toolchain_path is not None:
-        env['PATH'] = os.path.join(toolchain_path, 'bin') + \
+    if args.toolchain_path is not None:
+        env['PATH'] = os.path.join(args.toolchain_path, 'bin') + \
                       os.pathsep + \
                       os.environ['PATH']
 
-    if cflags is not None:
-        env['CFLAGS'] = cflags
-    if cxxflags is not None:
-        env['CXXFLAGS'] = cxxflags
-
-    if not build_only and not check_only and not xcheck_only:
-        build_only = check_only = xcheck_only = True
+    if args.cflags is not None:
+        env['CFLAGS'] = args.cflags
+    if args.cxxflags is not None:
+        env['CXXFLAGS'] = args.cxxflags
+
+    if args.ccache:
+        ccache = which('ccache', path=env.get('PATH'))
+        if ccache is None:
+            raise GlibcTestSuiteError('ccache was not found')
+        env['CC'] = f'{ccache} {args.toolchain_prefix}-gcc'
+        env['CXX'] = f'{ccache} {args.toolchain_prefix}-g++'
+
+    return env
+
+
+def create_testsuite(args, check_only, xcheck_only, build_dir=None):
+    return GlibcTestSuite(args.toolchain_prefix,
+                          args.allow_time_setting,
+                          args.timeoutfactor,
+                          args.glibc_dir,
+                          args.kernel,
+                          args.unfs,
+                          args.cpu,
+                          args.qemu_path,
+                          args.qemu_extra_opts,
+                          args.nsim_path,
+                          args.nsim_propsfile,
+                          args.nsim_ifname,
+                          args.build_jobs,
+                          args.test_jobs,
+                          args.linux_headers_dir,
+                          args.linux_headers_version,
+                          args.toolchain_path,
+                          args.ssh_host,
+                          args.ssh_port,
+                          args.nfs_server_ip,
+                          args.subdir,
+                          args.verbose,
+                          check_only,
+                          xcheck_only,
+                          create_env(args),
+                          emulators=args.emulators,
+                          ssh_multiplexing=not args.no_ssh_multiplexing,
+                          boot_snapshot=args.qemu_boot_snapshot,
+                          snapshot_dir=args.qemu_snapshot_dir,
+                          qemu_user_path=args.qemu_user_path,
+                          qemu_user_allow=args.qemu_user_allow,
+                          qemu_user_deny=args.qemu_user_deny,
+                          json_report=args.json_report,
+                          junit_report=args.junit_report,
+                          history_path=args.duration_history,
+                          rerun_failed=args.rerun_failed,
+                          force_stages=args.force,
+                          share=args.share,
+                          virtiofsd_path=args.virtiofsd_path,
+                          qemu_memory=args.qemu_memory,
+                          stage_tests=args.stage_tests,
+                          auto_tune=args.auto_tune,
+                          watchdog=args.watchdog,
+                          adaptive_timeouts=args.adaptive_timeouts,
+                          nsim_create_taps=args.nsim_create_taps,
+                          build_dir=build_dir,
+                          run_db=None if args.no_run_db else args.run_db,
+                          progress_file=args.progress_file,
+                          server_socket=args.server_socket if args.server
+                          else None,
+                          schedule_subdirs=args.schedule_subdirs)
+
+
+def run_testsuite(testsuite, args, build_only, check_only, xcheck_only):
+    if args.overlap_boot and build_only and (check_only or xcheck_only):
+        testsuite.start_in_background()
 
     try:
-        testsuite = GlibcTestSuite(args.toolchain_prefix,
-                                   args.allow_time_setting,
-                                   args.timeoutfactor,
-                                   args.glibc_dir,
-                                   args.kernel,
-                                   args.unfs,
-                                   args.cpu,
-                                   args.qemu_path,
-                                   args.qemu_extra_opts,
-                                   args.nsim_path,
-                                   args.nsim_propsfile,
-                                   args.nsim_ifname,
-                                   args.build_jobs,
-                                   args.test_jobs,
-                                   args.linux_headers_dir,
-                                   args.linux_headers_version,
-                                   args.toolchain_path,
-                                   args.ssh_host,
-                                   args.ssh_port,
-                                   args.nfs_server_ip,
-                                   args.subdir,
-                                   args.verbose,
-                                   check_only,
-                                   xcheck_only,
-                                   env)
-
         if build_only:
             testsuite.configure()
             testsuite.build()
             testsuite.install()
+    except BaseException:
+        testsuite.stop()
+        raise
+
+    if check_only or xcheck_only:
+        return testsuite.run()
+    return None
+
+
+def run_matrix(args, build_only, check_only, xcheck_only):
+    try:
+        matrix = load_matrix(args.matrix, vars(args))
+    except MatrixError as err:
+        raise GlibcTestSuiteError(err)
+
+    # the configurations are built at the same time, so they share the
+    # build jobs
+    build_jobs = max(1, args.build_jobs // len(matrix))
+
+    def run_configuration(configuration):
+        # a configuration may still set build_jobs of its own
+        options = dict(vars(args), build_jobs=build_jobs)
+        options.update(configuration)
+        name = options.pop('name')
+        # files of the command line would be written by all configurations
+        for option in MATRIX_FILES:
+            if options[option] and option not in configuration:
+                root, ext = os.path.splitext(options[option])
+                options[option] = f'{root}-{name}{ext}'
+        # and every QEMU guest would forward the same SSH port
+        if options['qemu_path'] and 'ssh_port' not in configuration:
+            options['ssh_port'] = None
+        testsuite = create_testsuite(
+            argparse.Namespace(**options), check_only, xcheck_only,
+            build_dir=os.path.join(args.glibc_dir, f'build-{name}'))
+        return run_testsuite(testsuite, args, build_only, check_only,
+                             xcheck_only)
+
+    logging.info('running %d configurations with %d build jobs each',
+                 len(matrix), build_jobs)
+    exitcode = 0
+    results = {}
+    with ThreadPoolExecutor(max_workers=len(matrix)) as executor:
+        futures = {configuration['name']:
+                   executor.submit(run_configuration, configuration)
+                   for configuration in matrix}
+        for name, future in futures.items():
+            try:
+                result = future.result()
+            except GlibcTestSuiteError as err:
+                logging.error('%s: %s', name, err)
+                exitcode = 1
+                continue
+            if result is not None:
+                results[name] = result
+                exitcode = max(exitcode, result.exitcode())
+
+    if results:
+        print('\n'.join(comparison_table(results)))
+    return exitcode
+
+
+def parse_compare_arguments(argv):
+    parser = argparse.ArgumentParser(
+        prog=f'{os.path.basename(sys.argv[0])} compare',
+        description='compare a run with a previous run of the same '
+                    'configuration')
+    logging.basicConfig(stream=sys.stderr, format='%(levelname)s: %(message)s',
+                        level=logging.INFO)
 
-        if check_only or xcheck_only:
-            testsuite.run()
+    parser.add_argument('run',
+                        nargs='?',
+                        default='latest',
+                        help='run id(latest)')
+
+    parser.add_argument('--base',
+                        type=str,
+                        help='run id or "best" for the best known results '
+                             '(latest result of every test in the previous '
+                             'runs of the same configuration)')
+
+    parser.add_argument('--run-db',
+                        type=str,
+                        default=RUN_DB,
+                        help=f'SQLite database of the test runs({RUN_DB})')
+
+    slowdown = 1.5
+    parser.add_argument('--slowdown',
+                        type=float,
+                        default=slowdown,
+                        help='duration ratio reported as a regression'
+                             f'({slowdown})')
+
+    min_duration = 1.0
+    parser.add_argument('--min-duration',
+                        type=float,
+                        default=min_duration,
+                        help='seconds below which slowdowns are ignored'
+                             f'({min_duration})')
+
+    parser.add_argument('--list',
+                        help='list the recorded runs',
+                        action='store_true')
+
+    return parser.parse_args(argv)
+
+
+def print_runs(database):
+    for run, started, prefix, cflags, cpu, emulator, tests, failures in \
+            database.runs():
+        started = time.strftime('%Y-%m-%d %H:%M', time.localtime(started))
+        configuration = ' '.join(value for value in
+                                 (prefix, cpu, emulator, cflags) if value)
+        print(f'{run:>5} {started} {tests:>6} tests {failures:>5} failed '
+              f'{configuration}')
+
+
+def print_changes(title, changes, durations=False):
+    if not changes:
+        return
+    print(f'{title}({len(changes)}):')
+    for change in changes:
+        if durations:
+            print(f'  {change.test}: {change.old_duration:.2f}s -> '
+                  f'{change.new_duration:.2f}s')
+        else:
+            print(f'  {change.test}: {change.old_status} -> '
+                  f'{change.new_status}')
+
+
+def compare_runs(argv):
+    args = parse_compare_arguments(argv)
+    if not os.path.isfile(args.run_db):
+        logging.error('run database %s doesn\'t exist', args.run_db)
+        return 1
+
+    try:
+        database = RunDatabase(args.run_db)
+        try:
+            if args.list:
+                print_runs(database)
+                return 0
+            run = args.run if args.run == 'latest' else int(args.run)
+            base = args.base if args.base in (None, 'best') else \
+                int(args.base)
+            comparison = database.compare(run, base, args.slowdown,
+                                          args.min_duration)
+        finally:
+            database.close()
+    except ValueError as err:
+        logging.error('invalid run id: %s', err)
+        return 1
+    except RunDatabaseError as err:
+        logging.error(err)
+        return 1
+
+    if comparison.base == 'best':
+        base = 'the best known results'
+    elif comparison.base == 'previous':
+        base = 'the previous results'
+    else:
+        base = f'run {comparison.base}'
+    print(f'run {comparison.run} compared with {base}')
+    print_changes('new failures', comparison.new_failures)
+    print_changes('fixed', comparison.fixes)
+    print_changes('slower', comparison.regressions, durations=True)
+    return 1 if comparison.new_failures else 0
+
+
+def main():
+    if sys.argv[1:2] == ['compare']:
+        return compare_runs(sys.argv[2:])
+
+    args = parse_arguments()
+
+    build_only = args.build_only
+    check_only = args.check_only
+    xcheck_only = args.xcheck_only
+
+    if not build_only and not check_only and not xcheck_only:
+        build_only = check_only = xcheck_only = True
+
+    if args.serve:
+        try:
+            testsuite = create_testsuite(args, False, False)
+            testsuite.serve(args.server_socket, args.idle_timeout)
+            return 0
+        except GlibcTestSuiteError as err:
+            logging.error(err)
+            sys.exit(1)
+
+    if args.matrix:
+        try:
+            return run_matrix(args, build_only, check_only, xcheck_only)
+        except GlibcTestSuiteError as err:
+            logging.error(err)
+            sys.exit(1)
+        finally:
+            write_trace(args.trace or
+                        os.path.join(CACHE_DIR, 'matrix-trace.json'))
+
+    testsuite = None
+    try:
+        testsuite = create_testsuite(args, check_only, xcheck_only)
+        results = run_testsuite(testsuite, args, build_only, check_only,
+                                xcheck_only)
+        if results is not None:
+            return results.exitcode()
 
     except GlibcTestSuiteError as err:
         logging.error(err)
         sys.exit(1)
+    finally:
+        if testsuite is not None:
+            write_trace(args.trace or
+                        os.path.join(testsuite.build_dir, 'trace.json'))
 
 
 if __name__ == '__main__':
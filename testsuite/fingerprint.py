@@ -0,0 +1,100 @@
+import hashlib
+import json
+import os
+import subprocess
+import utils
+from shutil import which
+
+STAGES = ('configure', 'build', 'install')
+
+
+def digest(*items):
+    return hashlib.sha256(
+        json.dumps(items, sort_keys=True).encode()).hexdigest()
+
+
+def git_state(path):
+    try:
+        revision = subprocess.run(['git', 'rev-parse', 'HEAD'],
+                                  cwd=path, capture_output=True, check=True)
+        # build directories and other untracked files don't change sources
+        status = subprocess.run(['git', 'status', '--porcelain',
+                                 '--untracked-files=no'],
+                                cwd=path, capture_output=True, check=True)
+        diff = subprocess.run(['git', 'diff', 'HEAD'],
+                              cwd=path, capture_output=True, check=True)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+    return digest(revision.stdout.decode().strip(),
+                  status.stdout.decode(),
+                  hashlib.sha256(diff.stdout).hexdigest())
+
+
+def tree_state(path):
+    entries = []
+    for root, _, files in os.walk(path):
+        for name in sorted(files):
+            file_path = os.path.join(root, name)
+            try:
+                stat = os.stat(file_path)
+            except OSError:
+                continue
+            entries.append((os.path.relpath(file_path, path),
+                            stat.st_size, stat.st_mtime_ns))
+    return digest(sorted(entries))
+
+
+def program_state(name, env=None):
+    env = dict(os.environ, **(env or {}))
+    path = which(name, path=env.get('PATH'))
+    if path is None:
+        return None
+
+    state = [path, utils.file_hash(path)]
+    try:
+        cc1 = subprocess.run([path, '-print-prog-name=cc1'], env=env,
+                             capture_output=True, check=True)
+        cc1_path = cc1.stdout.decode().strip()
+        if os.path.isfile(cc1_path):
+            state.append(utils.file_hash(cc1_path))
+    except (OSError, subprocess.CalledProcessError):
+        pass
+    return digest(state)
+
+
+class StageFingerprints:
+    def __init__(self, path):
+        self.path = path
+        try:
+            with open(path) as fingerprints:
+                self.fingerprints = json.load(fingerprints)
+        except (OSError, ValueError):
+            self.fingerprints = {}
+
+    def get(self, stage):
+        return self.fingerprints.get(stage)
+
+    def unchanged(self, stage, stage_digest, outputs):
+        return stage_digest is not None and \
+            self.fingerprints.get(stage) == stage_digest and \
+            all(os.path.exists(output) for output in outputs)
+
+    def _save(self):
+        utils.mkdir(os.path.dirname(self.path))
+        temp_path = f'{self.path}.tmp'
+        with open(temp_path, 'w') as fingerprints:
+            json.dump(self.fingerprints, fingerprints, indent=2)
+        os.replace(temp_path, self.path)
+
+    def invalidate(self, stage):
+        # a stage being rerun invalidates every stage after it
+        for later in STAGES[STAGES.index(stage):]:
+            self.fingerprints.pop(later, None)
+        self._save()
+
+    def update(self, stage, stage_digest):
+        if stage_digest is None:
+            return
+        self.fingerprints[stage] = stage_digest
+        self._save()
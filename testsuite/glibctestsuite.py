@@ -1,16 +1,62 @@
+import hashlib
+import json
 import logging
+import math
 import os
+import queue
+import re
+import shlex
 import socket
+import sqlite3
 import subprocess
+import sys
+import tarfile
 import tempfile
+import threading
+import time
 import utils
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import cached_property
 from emulators.emulator import EmulatorError
 from emulators.nsim import NsimEmulator
 from emulators.qemu import QemuEmulator
-from shutil import copyfile
+from emulators.qemuuser import QemuUserEmulator
+from shutil import copyfile, rmtree, which
+from testsuite import fingerprint
+from testsuite.history import DurationHistory
+from testsuite.progress import Progress
+from testsuite.results import TestResults, iter_duration_records
+from testsuite.rundb import RunDatabase, RunDatabaseError
+from testsuite.server import GuestLease, GuestServer, ServerError, \
+    remove_stale_socket
+from testsuite.stage import STAGE_DIR, iter_staged
+from testsuite.target import Target
+from testsuite.watchdog import Watchdog
 from utils import run_command, mkdir, get_free_port
-from utils.ssh import SSHConnection, SSHConnectionError
+from utils.jobserver import Jobserver
+from utils.ssh import SSHConnection, SSHConnectionError, SSHMaster
+from utils.trace import span, traced
+from utils.tap import TapError, TapPool
 from utils.unfs import Unfs
+from utils.virtiofs import Virtiofsd, VirtiofsdError
+
+
+RERUN_STATUSES = ('FAIL', 'ERROR', 'UNRESOLVED', 'UNSUPPORTED', 'CRASH')
+SHARES = ('nfs', '9p', 'virtiofs')
+SHARE_TAG = 'glibc'
+MAX_GUEST_CPUS = 4
+GUEST_MEMORY_RANGE = (256, 2048)
+MAX_RESTARTS = 3
+# TIMEOUTFACTOR multiplies the TIMEOUT of a test, which its source
+# defines, or the default timeout of glibc tests
+TEST_TIMEOUT = 20
+TIMEOUT_DEFINE = re.compile(r'^\s*#\s*define\s+TIMEOUT\s+(.+?)\s*(/[*/].*)?$',
+                            re.MULTILINE)
+TIMEOUT_MULTIPLIER = 10
+TIMEOUT_FLOOR = 60
+# subdirs run at the same time on a target with --schedule-subdirs
+SUBDIRS_PER_TARGET = 2
 
 
 class GlibcTestSuiteError(Exception):
@@ -43,7 +89,32 @@ class GlibcTestSuite:
                  verbose=False,
                  run_check=True,
                  run_xcheck=True,
-                 env=None
+                 env=None,
+                 emulators=1,
+                 ssh_multiplexing=True,
+                 boot_snapshot=False,
+                 snapshot_dir=None,
+                 qemu_user_path=None,
+                 qemu_user_allow=None,
+                 qemu_user_deny=None,
+                 json_report=None,
+                 junit_report=None,
+                 history_path=None,
+                 rerun_failed=False,
+                 force_stages=False,
+                 share='nfs',
+                 virtiofsd_path=None,
+                 qemu_memory=None,
+                 stage_tests=False,
+                 auto_tune=False,
+                 watchdog=False,
+                 adaptive_timeouts=False,
+                 nsim_create_taps=False,
+                 build_dir=None,
+                 run_db=None,
+                 progress_file=None,
+                 server_socket=None,
+                 schedule_subdirs=False
                  ):
 
         self.cpu = cpu
@@ -51,9 +122,22 @@ class GlibcTestSuite:
         self.allow_time_setting = allow_time_setting
         self.timeoutfactor = timeoutfactor
         self.glibc_dir = os.path.realpath(glibc_dir)
-        self.build_dir = os.path.join(self.glibc_dir, 'build')
+        self.build_dir = os.path.realpath(build_dir) if build_dir else \
+            os.path.join(self.glibc_dir, 'build')
         self.install_dir = os.path.join(self.build_dir, 'install')
-        self.emulator = None
+        self.durations_path = os.path.join(self.build_dir,
+                                           'test-durations.jsonl')
+        self.json_report = json_report or os.path.join(self.build_dir,
+                                                       'results.json')
+        self.junit_report = junit_report or os.path.join(self.build_dir,
+                                                         'results.xml')
+        self.fingerprints = fingerprint.StageFingerprints(
+            os.path.join(self.build_dir, 'stage-fingerprints.json'))
+        self.force_stages = force_stages
+        self.history_path = history_path or \
+            os.path.join(self.build_dir, 'durations.json')
+        self.history = None
+        self.targets = []
         self.qemu_path = qemu_path
         self.qemu_extra_opts = qemu_extra_opts
         self.nsim_path = nsim_path
@@ -63,20 +147,134 @@ class GlibcTestSuite:
         self.unfs_path = None
         self.build_jobs = build_jobs
         self.test_jobs = test_jobs
-        self.linux_headers_dir = os.path.realpath(linux_headers_dir)
+        self.linux_headers_dir = linux_headers_dir and \
+            os.path.realpath(linux_headers_dir)
         self.linux_headers_version = linux_headers_version
         self.toolchain_path = toolchain_path
-        self.ssh_host = ssh_host
+        self.ssh_hosts = self._parse_ssh_hosts(ssh_host)
+        self.ssh_host = self.ssh_hosts[0][0] if self.ssh_hosts else None
         self.ssh_port = 22 if ssh_port is None else ssh_port
         self.nfs_server_ip = nfs_server_ip
-        self.subdir = subdir
+        # make takes the subdirs as a space separated list
+        self.subdir = ' '.join(subdir.replace(',', ' ').split()) \
+            if subdir else None
+        self.rerun_failed = rerun_failed
+        self.schedule_subdirs = schedule_subdirs
         self.verbose = verbose
         self.env = env
+        self.emulators = emulators
+        self.ssh_multiplexing = ssh_multiplexing
+        self.boot_snapshot = boot_snapshot
+        self.boot_snapshot_path = None
+        self.snapshot_dir = snapshot_dir
+        self.snapshot_lock = threading.Lock()
+        self.qemu_user = None
+        self.wrapper_dir = None
+        self.test_wrapper = None
+        self.boot_lock = threading.Lock()
+        self.booting = set()
+        self.stopping = False
+        self.start_executor = None
+        self.start_future = None
+        self.share = share
+        self.share_servers = []
+        self.virtiofsd_path = virtiofsd_path
+        self.qemu_memory = qemu_memory
+        self.stage_tests = stage_tests
+        self.auto_tune = auto_tune
+        # boards of a farm are health checked to drop the failed ones
+        self.watchdog = watchdog or len(self.ssh_hosts) > 1
+        self.nfs_ports = (0, 0)
+        self.adaptive_timeouts = adaptive_timeouts
+        self.timeouts_path = None
+        self.test_timeouts = {}
+        self.smp = None
+        self.staged_files = {}
+        self.tap_pool = None
+        self.run_db = run_db
+        self.progress_file = progress_file and \
+            os.path.realpath(progress_file)
+        # guests are leased from a server instead of being booted
+        self.server_socket = server_socket
+        self.lease = None
+        self.leased_emulator = None
 
         if qemu_path and (nsim_propsfile or nsim_ifname):
             raise GlibcTestSuiteError(
                 'Only one emulator can be executed at the same time')
 
+        if not self.build_dir.startswith(self.glibc_dir + os.sep):
+            raise GlibcTestSuiteError(
+                'Build directory must be inside glibc directory')
+
+        if len(self.ssh_hosts) > 1 and (qemu_path or nsim_propsfile):
+            raise GlibcTestSuiteError(
+                'Several SSH hosts are supported only for boards')
+
+        if emulators < 1:
+            raise GlibcTestSuiteError('Number of emulators must be positive')
+
+        if emulators > 1 and not qemu_path and not nsim_propsfile and \
+                not server_socket:
+            raise GlibcTestSuiteError(
+                'Multiple emulators are supported only for QEMU and nSIM')
+
+        # several nSIM instances get their TAPs and guest addresses from a
+        # pool, a single TAP keeps the --ssh-host guest address
+        nsim_ifnames = nsim_ifname.split(',') if nsim_ifname else []
+        if nsim_propsfile and \
+                (emulators > 1 or nsim_create_taps or len(nsim_ifnames) > 1):
+            self.tap_pool = TapPool(nsim_ifnames, emulators, nsim_create_taps)
+            self.nsim_ifname = None
+
+        if boot_snapshot and not qemu_path:
+            raise GlibcTestSuiteError(
+                'Boot snapshots are supported only for QEMU')
+
+        if share not in SHARES:
+            raise GlibcTestSuiteError(f'Unknown share type: {share}')
+
+        if share != 'nfs' and not qemu_path:
+            raise GlibcTestSuiteError(
+                f'{share} share is supported only for QEMU')
+
+        if share == 'virtiofs' and boot_snapshot:
+            raise GlibcTestSuiteError(
+                'Boot snapshots can\'t be used with virtiofs share')
+
+        if server_socket and (qemu_path or nsim_propsfile):
+            raise GlibcTestSuiteError(
+                'Guests of a server can\'t be combined with an emulator')
+
+        if auto_tune and not qemu_path:
+            raise GlibcTestSuiteError(
+                'Auto-tuning is supported only for QEMU')
+
+        if auto_tune:
+            self._auto_tune_layout()
+
+        if share == 'virtiofs':
+            self.virtiofsd_path = virtiofsd_path or which('virtiofsd')
+            if self.virtiofsd_path is None:
+                raise GlibcTestSuiteError('virtiofsd was not found')
+            if qemu_memory is None:
+                self.qemu_memory = '1G'
+
+        if qemu_user_path:
+            allow = qemu_user_allow and self._read_list(qemu_user_allow,
+                                                        'test list')
+            deny = qemu_user_deny and self._read_list(qemu_user_deny,
+                                                      'test list')
+            try:
+                self.qemu_user = QemuUserEmulator(
+                    qemu_path=os.path.realpath(qemu_user_path),
+                    sysroot=self.install_dir,
+                    cpu=cpu,
+                    allow=allow,
+                    deny=deny)
+            except EmulatorError as err:
+                raise GlibcTestSuiteError(err)
+
         if qemu_path:
             self.qemu_path = os.path.realpath(qemu_path)
             if kernel_path is None:
@@ -100,12 +298,165 @@ class GlibcTestSuite:
         if self.nfs_server_ip is None:
             self.nfs_server_ip = self._host_ip_address()
 
+        if ':' in self.nfs_server_ip and self.unfs_path and share == 'nfs':
+            raise GlibcTestSuiteError(
+                f'unfs3 doesn\'t serve NFS over IPv6, please, specify an '
+                f'IPv4 NFS server address instead of {self.nfs_server_ip}')
+
+        # the emulator of the configuration is known only now, or with the
+        # lease of the guests of a server
+        if not server_socket:
+            self._load_history()
+
         self.make_options = []
         if run_check:
             self.make_options.append('check')
         if run_xcheck:
             self.make_options.append('xcheck')
 
+    def _emulator_name(self):
+        if self.server_socket:
+            return self.leased_emulator or 'board'
+        if self.qemu_path:
+            return 'qemu'
+        if self.nsim_propsfile:
+            return f'nsim:{os.path.basename(self.nsim_propsfile)}'
+        if self.qemu_user and not self._needs_targets():
+            return 'qemu-user'
+        return 'board'
+
+    def configuration(self):
+        return {
+            'toolchain_prefix': self.toolchain_prefix,
+            'cflags': (self.env or {}).get('CFLAGS'),
+            'cpu': self.cpu,
+            'emulator': self._emulator_name()
+        }
+
+    def _load_history(self):
+        self.history = DurationHistory(self.history_path, self.configuration())
+        if self.run_db and not self.history.tests:
+            self._seed_history()
+
+    def _seed_history(self):
+        try:
+            database = RunDatabase(self.run_db)
+            try:
+                tests = database.test_durations(self.configuration(),
+                                                DurationHistory.SAMPLES)
+            finally:
+                database.close()
+        except (RunDatabaseError, sqlite3.Error) as err:
+            logging.warning('Failed to read durations from run database: %s',
+                            err)
+            return
+
+        if tests:
+            logging.info('duration history seeded with %d tests from %s',
+                         len(tests), self.run_db)
+            self.history.seed(tests)
+
+    def _record_run(self, results):
+        try:
+            database = RunDatabase(self.run_db)
+            try:
+                run = database.add_run(self.configuration(), results,
+                                       self.source_state)
+            finally:
+                database.close()
+        except RunDatabaseError as err:
+            logging.warning('Failed to save run: %s', err)
+            return
+
+        logging.info('run %d saved to %s', run, self.run_db)
+
+    def _read_list(self, path, name):
+        try:
+            return utils.read_list(path)
+        except OSError as err:
+            raise GlibcTestSuiteError(f'Cannot read {name} {path}: {err}')
+
+    def _parse_ssh_host(self, entry):
+        # host, host:port, an IPv6 address, or [IPv6 address]:port
+        if entry.startswith('['):
+            host, bracket, port = entry[1:].partition(']')
+            if not bracket or port and not port.startswith(':'):
+                raise GlibcTestSuiteError(f'Invalid SSH host: {entry}')
+            port = port[1:] or None
+        elif entry.count(':') == 1:
+            host, port = entry.split(':')
+        else:
+            host, port = entry, None
+
+        if not host:
+            raise GlibcTestSuiteError(f'Invalid SSH host: {entry}')
+        try:
+            return host, int(port) if port is not None else None
+        except ValueError:
+            raise GlibcTestSuiteError(f'Invalid SSH host: {entry}')
+
+    def _parse_ssh_hosts(self, value):
+        if not value:
+            return []
+
+        if os.path.isfile(value):
+            entries = self._read_list(value, 'SSH hosts')
+        else:
+            entries = value.split(',')
+
+        hosts = [self._parse_ssh_host(entry.strip())
+                 for entry in entries if entry.strip()]
+        if not hosts:
+            raise GlibcTestSuiteError(f'No SSH hosts in {value}')
+        return hosts
+
+    def _auto_tune_layout(self):
+        cores = len(os.sched_getaffinity(0))
+        memory = utils.available_memory() // (1 << 20)
+        extra_opts = (self.qemu_extra_opts or '').split()
+
+        if '-smp' not in extra_opts:
+            self.smp = max(1, min(MAX_GUEST_CPUS, cores // self.emulators))
+
+        if self.qemu_memory is None and '-m' not in extra_opts:
+            # half of the available memory is left to the host
+            low, high = GUEST_MEMORY_RANGE
+            size = memory // 2 // self.emulators
+            self.qemu_memory = f'{min(max(size, low), high)}M'
+
+        logging.info('auto-tune: host has %d cores and %d MiB available, '
+                     'booting %d emulators with %s CPUs and %s memory',
+                     cores, memory, self.emulators, self.smp or 'default',
+                     self.qemu_memory or 'default')
+
+    def _guest_cpus(self, target):
+        if target.emulator is None:
+            return None
+
+        output, exitcode = target.emulator.run(
+            'grep -c ^processor /proc/cpuinfo', timeout=30)
+        try:
+            return int(output[-1]) if not exitcode else None
+        except (IndexError, ValueError):
+            return None
+
+    def _auto_tune_test_jobs(self):
+        cpus = [self._guest_cpus(target) for target in self.targets]
+        cpus = [count for count in cpus if count]
+        if not cpus:
+            logging.warning('auto-tune: failed to probe guest CPUs, '
+                            'running %d test jobs', self.test_jobs)
+            return
+
+        self.test_jobs = min(cpus)
+        logging.info('auto-tune: %d online CPUs per guest, running %d test '
+                     'jobs on each of %d targets',
+                     min(cpus), self.test_jobs, len(self.targets))
+
+    @cached_property
+    def source_state(self):
+        return fingerprint.git_state(self.glibc_dir)
+
     def _install_library(self, library_name):
         if self.toolchain_path is None:
             return
@@ -118,8 +469,10 @@ class GlibcTestSuite:
 
     def _host_ip_address(self):
         try:
-            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-            sock.connect((self.ssh_host, self.ssh_port))
+            family, _, _, _, address = socket.getaddrinfo(
+                self.ssh_host, self.ssh_port, type=socket.SOCK_DGRAM)[0]
+            sock = socket.socket(family, socket.SOCK_DGRAM)
+            sock.connect(address)
             address = sock.getsockname()[0]
             sock.close()
             return address
@@ -130,123 +483,771 @@ class GlibcTestSuite:
         self.unfs = Unfs(self.unfs_path, self.glibc_dir)
         return self.unfs.serve()
 
-    def _setup_nsim_network(self):
-        netmask = utils.get_netmask(self.nsim_ifname)
-        self.emulator.run(f'ip a add {self.ssh_host}/{netmask} dev eth0')
-        self.emulator.run('ip l set up dev eth0')
+    def _setup_nsim_network(self, emulator, address, netmask):
+        emulator.run(f'ip a add {address}/{netmask} dev eth0')
+        emulator.run('ip l set up dev eth0')
+
+    def _log_path(self, name, index):
+        suffix = f'-{index}' if self.emulators > 1 else ''
+        return os.path.join(self.build_dir,
+                            f'{name}-{utils.timestamp()}{suffix}.log.gz')
+
+    @contextmanager
+    def _booting(self, emulator):
+        with self.boot_lock:
+            if self.stopping:
+                raise EmulatorError('Emulator startup was aborted')
+            self.booting.add(emulator)
+        try:
+            yield
+        finally:
+            with self.boot_lock:
+                self.booting.discard(emulator)
+
+    def _boot_snapshot_key(self):
+        key = hashlib.sha256()
+        for item in [utils.file_hash(self.qemu_path),
+                     utils.file_hash(self.kernel_path),
+                     self.cpu,
+                     self.share,
+                     self.qemu_memory or '',
+                     str(self.smp or ''),
+                     self.qemu_extra_opts or '']:
+            key.update(item.encode())
+            key.update(b'\0')
+        return key.hexdigest()
 
-    def _run_qemu(self):
+    def _save_boot_snapshot(self, emulator):
+        with self.snapshot_lock:
+            if os.path.isfile(self.boot_snapshot_path):
+                return
+            try:
+                mkdir(self.snapshot_dir)
+                emulator.save_state(self.boot_snapshot_path)
+            except (EmulatorError, OSError) as err:
+                logging.warning('Failed to save boot snapshot: %s', err)
+
+    def _restore_boot_snapshot(self, qemu_options, qemu_log):
+        emulator = None
+        try:
+            logging.info('restoring boot snapshot: %s', self.boot_snapshot_path)
+            emulator = QemuEmulator(qemu_path=self.qemu_path,
+                                    options=qemu_options,
+                                    kernel=self.kernel_path,
+                                    log_path=qemu_log,
+                                    incoming=self.boot_snapshot_path)
+            with self._booting(emulator):
+                emulator.resume()
+            return emulator
+        except EmulatorError as err:
+            logging.warning('Failed to restore boot snapshot %s: %s',
+                            self.boot_snapshot_path, err)
+            if emulator is not None:
+                emulator.stop()
+
+        with self.snapshot_lock:
+            if os.path.isfile(self.boot_snapshot_path):
+                os.unlink(self.boot_snapshot_path)
+        return None
+
+    def _share_options(self):
+        if self.share == '9p':
+            return [
+                '-fsdev', f'local,id=share0,path={self.glibc_dir},'
+                          'security_model=none',
+                '-device', f'virtio-9p-device,fsdev=share0,mount_tag={SHARE_TAG}'
+            ]
+
+        if self.share == 'virtiofs':
+            virtiofsd = Virtiofsd(self.virtiofsd_path, self.glibc_dir)
+            with self.boot_lock:
+                self.share_servers.append(virtiofsd)
+            try:
+                socket_path = virtiofsd.serve()
+            except VirtiofsdError as err:
+                raise GlibcTestSuiteError(err)
+
+            # vhost-user devices need the guest memory to be shared
+            return [
+                '-chardev', f'socket,id=share0,path={socket_path}',
+                '-device', f'vhost-user-fs-device,chardev=share0,tag={SHARE_TAG}',
+                '-object', f'memory-backend-memfd,id=mem,size={self.qemu_memory},'
+                           'share=on',
+                '-machine', 'memory-backend=mem'
+            ]
+
+        return []
+
+    @traced('boot qemu', 'emulator')
+    def _run_qemu(self, index, ssh_port):
         qemu_options = [
             '-cpu', self.cpu,
-            '-netdev', f'user,id=net0,hostfwd=tcp::{self.ssh_port}-:22',
+            '-netdev', f'user,id=net0,hostfwd=tcp::{ssh_port}-:22',
             '-device', 'virtio-net-device,netdev=net0',
             '--global', 'cpu.freq_hz=50000000'
         ]
 
+        if self.smp:
+            qemu_options += ['-smp', str(self.smp),
+                             '-accel', 'tcg,thread=multi']
+
+        if self.qemu_memory:
+            qemu_options += ['-m', self.qemu_memory]
+
+        qemu_options += self._share_options()
+
         if self.qemu_extra_opts:
             qemu_options += self.qemu_extra_opts.split(' ')
 
-        qemu_log = os.path.join(self.build_dir, f'qemu-{utils.timestamp()}.log')
+        qemu_log = self._log_path('qemu', index)
 
+        if self.boot_snapshot_path and os.path.isfile(self.boot_snapshot_path):
+            emulator = self._restore_boot_snapshot(qemu_options, qemu_log)
+            if emulator is not None:
+                return emulator
+
+        emulator = None
         try:
-            self.emulator = QemuEmulator(qemu_path=self.qemu_path,
-                                         options=qemu_options,
-                                         kernel=self.kernel_path,
-                                         log_path=qemu_log)
-            self.emulator.login()
+            emulator = QemuEmulator(qemu_path=self.qemu_path,
+                                    options=qemu_options,
+                                    kernel=self.kernel_path,
+                                    log_path=qemu_log,
+                                    monitor=self.boot_snapshot)
+            with self._booting(emulator):
+                emulator.login()
+            if self.boot_snapshot_path:
+                self._save_boot_snapshot(emulator)
+            return emulator
         except EmulatorError as err:
+            if emulator is not None:
+                emulator.stop()
             raise GlibcTestSuiteError(err)
 
-    def _run_nsim(self):
+    @traced('boot nsim', 'emulator')
+    def _run_nsim(self, index=0, tap=None):
+        ifname = tap.ifname if tap else self.nsim_ifname
         nsim_options = [
-            f'nsim_mem-dev=virt-net,start=0xf0108000,end=0xf010a000,irq=35,tap={self.nsim_ifname}'
+            f'nsim_mem-dev=virt-net,start=0xf0108000,end=0xf010a000,irq=35,tap={ifname}'
         ]
 
-        nsim_log = os.path.join(self.build_dir, f'nsim-{utils.timestamp()}.log')
+        nsim_log = self._log_path('nsim', index)
 
+        emulator = None
         try:
-            self.emulator = NsimEmulator(nsim_path=self.nsim_path,
-                                         kernel=self.kernel_path,
-                                         props=nsim_options,
-                                         propsfile=self.nsim_propsfile,
-                                         log_path=nsim_log)
-            self.emulator.login()
-            if self.nsim_ifname:
-                self._setup_nsim_network()
+            emulator = NsimEmulator(nsim_path=self.nsim_path,
+                                    kernel=self.kernel_path,
+                                    props=nsim_options,
+                                    propsfile=self.nsim_propsfile,
+                                    log_path=nsim_log)
+            with self._booting(emulator):
+                emulator.login()
+            if tap:
+                self._setup_nsim_network(emulator, tap.guest_ip, tap.netmask)
+            elif self.nsim_ifname:
+                self._setup_nsim_network(emulator, self.ssh_host,
+                                         utils.get_netmask(self.nsim_ifname))
+            return emulator
         except EmulatorError as err:
+            if emulator is not None:
+                emulator.stop()
             raise GlibcTestSuiteError(err)
 
-    def _mount_nfs(self, mount_dir, nfsport, mountport):
+    def _ssh_ports(self):
+        ports = [self.ssh_port]
+        while len(ports) < self.emulators:
+            port = get_free_port()
+            if port not in ports:
+                ports.append(port)
+        return ports
+
+    def _start_qemu_targets(self):
+        if self.boot_snapshot:
+            self.boot_snapshot_path = os.path.join(
+                self.snapshot_dir, f'qemu-{self._boot_snapshot_key()}.state')
+
+        targets = [Target(self.ssh_host, port) for port in self._ssh_ports()]
+        self._boot_targets(targets)
+
+    def _start_nsim_targets(self):
         try:
-            timeout = 300
-            logging.info('conneting to: %s:%s', self.ssh_host, self.ssh_port)
-            ssh = SSHConnection(hostname=self.ssh_host, port=self.ssh_port)
-            ssh.run(f'mkdir -p {mount_dir}', timeout=timeout)
-            mount_args = [
-                f'mount', '-o',
-                f'noac,nolock,nfsvers=3,port={nfsport},mountport={mountport}',
-                f'{self.nfs_server_ip}:{mount_dir}', mount_dir
+            taps = self.tap_pool.setup()
+        except TapError as err:
+            raise GlibcTestSuiteError(err)
+
+        targets = []
+        for tap in taps:
+            target = Target(tap.guest_ip, self.ssh_port)
+            target.tap = tap
+            target.server_ip = tap.host_ip
+            targets.append(target)
+        self._boot_targets(targets)
+
+    def _boot_emulator(self, index, target):
+        if self.qemu_path:
+            return self._run_qemu(index, target.port)
+        return self._run_nsim(index, target.tap)
+
+    def _boot_targets(self, targets):
+        error = None
+        with ThreadPoolExecutor(max_workers=len(targets)) as executor:
+            futures = [executor.submit(self._boot_emulator, index, target)
+                       for index, target in enumerate(targets)]
+            for target, future in zip(targets, futures):
+                try:
+                    target.emulator = future.result()
+                except GlibcTestSuiteError as err:
+                    error = err
+                    continue
+                self.targets.append(target)
+
+        if error is not None:
+            raise error
+
+    def _start_targets(self):
+        if self.qemu_path:
+            self._start_qemu_targets()
+            return
+
+        if self.tap_pool:
+            self._start_nsim_targets()
+            return
+
+        if self.nsim_propsfile:
+            emulator = self._run_nsim()
+            self.targets.append(Target(self.ssh_host, self.ssh_port, emulator))
+            return
+
+        for host, port in self.ssh_hosts or [(self.ssh_host, None)]:
+            self.targets.append(Target(host, port or self.ssh_port))
+
+    def _mount_args(self, target, mount_dir, nfsport, mountport):
+        if self.share == '9p':
+            return [
+                'mount', '-t', '9p', '-o',
+                'trans=virtio,version=9p2000.L,msize=512000,cache=none',
+                SHARE_TAG, mount_dir
             ]
-            logging.info('mounting NFS share: %s', ' '.join(mount_args))
 
-            ssh.run(' '.join(mount_args), timeout=timeout)
+        if self.share == 'virtiofs':
+            return ['mount', '-t', 'virtiofs', SHARE_TAG, mount_dir]
+
+        server_ip = target.server_ip or self.nfs_server_ip
+        if ':' in server_ip:
+            server_ip = f'[{server_ip}]'
+        return [
+            f'mount', '-o',
+            f'noac,nolock,nfsvers=3,port={nfsport},mountport={mountport}',
+            f'{server_ip}:{mount_dir}', mount_dir
+        ]
+
+    @traced('mount share', 'share')
+    def _mount_share(self, target, mount_dir, nfsport, mountport):
+        try:
+            timeout = 300
+            logging.info('conneting to: %s', target)
+            ssh = SSHConnection(hostname=target.hostname, port=target.port)
+            try:
+                ssh.run(f'mkdir -p {mount_dir}', timeout=timeout)
+                mount_args = self._mount_args(target, mount_dir, nfsport,
+                                              mountport)
+                logging.info('mounting %s share: %s', self.share,
+                             ' '.join(mount_args))
+
+                ssh.run(' '.join(mount_args), timeout=timeout)
+            finally:
+                ssh.close()
+        except SSHConnectionError as err:
+            raise GlibcTestSuiteError(
+                f'Failed to mount {self.share} share: {err}')
+
+    def _start_ssh_master(self, target):
+        target.ssh_master = SSHMaster(hostname=target.hostname,
+                                      port=target.port)
+        try:
+            target.ssh_master.start()
         except SSHConnectionError as err:
-            raise GlibcTestSuiteError(f'Failed to mount NFS mount: {err}')
+            raise GlibcTestSuiteError(err)
 
-    def _create_ssh_wrapper(self):
-        command = [
-            'exec',
-            'ssh',
+    def _ssh_options(self, target):
+        # only SSHMaster creates the master, a client which became one would
+        # hold its test open until all multiplexed sessions are closed
+        if target.ssh_master is not None:
+            return target.ssh_master.options() + ['-o', 'ControlMaster=no']
+
+        return [
             '-o', 'UserKnownHostsFile=/dev/null',
             '-o', 'StrictHostKeyChecking=no',
-            '-p', str(self.ssh_port),
-            '\"$@\"',
-            '\n'
+            '-p', str(target.port)
         ]
 
+    def _create_ssh_wrapper(self, target):
+        master = target.ssh_master
+        command = ['exec', 'ssh'] + self._ssh_options(target) + \
+            ['\"$@\"', '\n']
+
         with tempfile.NamedTemporaryFile(delete=False, mode="w") as ssh_cmd:
             ssh_cmd.write('#!/bin/sh\n\n')
+            if master is not None:
+                ssh_cmd.write(f'if [ -S {master.control_path} ]; '
+                              f'then echo reused >> {master.stats_path}; '
+                              f'else echo new >> {master.stats_path}; fi\n')
             ssh_cmd.write(' '.join(command))
 
         os.chmod(ssh_cmd.name, 0o775)
 
         return ssh_cmd.name
 
-    def _test_wrapper_command(self, ssh_cmd):
+    def _test_wrapper_command(self, target):
+        command = []
+        if target is not None:
+            command = [
+                os.path.join(self.glibc_dir, 'scripts', 'cross-test-ssh.sh'),
+                '--ssh', target.ssh_cmd,
+                '--timeoutfactor', str(self.timeoutfactor),
+                f'root@{target.hostname}'
+            ]
+
+            if self.allow_time_setting:
+                command += ['--allow-time-setting']
+
+        stage = None
+        if target is not None and target.staged:
+            subdirs = self._subdirs() if self.subdir else None
+            stage = {'dir': STAGE_DIR, 'subdirs': subdirs}
+
+        name = str(target) if target is not None else 'local'
+        return [self._create_test_wrapper(command, stage, name)]
+
+    def _create_test_wrapper(self, fallback, stage=None, target='local'):
+        config = {
+            'build_dir': self.build_dir,
+            'qemu_user': self.qemu_user.config() if self.qemu_user else None,
+            'fallback': fallback,
+            'durations': self.durations_path,
+            'stage': stage,
+            'target': target,
+            'timeouts': self.timeouts_path
+        }
+
+        with tempfile.NamedTemporaryFile(dir=self.wrapper_dir, suffix='.json',
+                                         delete=False, mode="w") as config_file:
+            json.dump(config, config_file)
+
+        repo_dir = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
         command = [
-            os.path.join(self.glibc_dir, 'scripts', 'cross-test-ssh.sh'),
-            '--ssh', ssh_cmd,
-            '--timeoutfactor', str(self.timeoutfactor),
-            f'root@{self.ssh_host}'
+            'exec', sys.executable, '-m', 'testsuite.wrapper',
+            config_file.name, '\"$@\"', '\n'
         ]
 
-        if self.allow_time_setting:
-            command += ['--allow-time-setting']
+        with tempfile.NamedTemporaryFile(dir=self.wrapper_dir, delete=False,
+                                         mode="w") as wrapper:
+            wrapper.write('#!/bin/sh\n\n')
+            wrapper.write(f'export PYTHONPATH={repo_dir}\n')
+            wrapper.write(' '.join(command))
+
+        os.chmod(wrapper.name, 0o775)
+
+        return wrapper.name
+
+    def _stage_target(self, target, names):
+        command = [
+            target.ssh_cmd, f'root@{target.hostname}',
+            f'mkdir -p {STAGE_DIR} && '
+            f'(grep -q " {STAGE_DIR} tmpfs " /proc/mounts || '
+            f'mount -t tmpfs tmpfs {STAGE_DIR}) && '
+            f'tar -xf - -C {STAGE_DIR}'
+        ]
+
+        process = subprocess.Popen(command,
+                                   stdin=subprocess.PIPE,
+                                   stdout=subprocess.DEVNULL,
+                                   stderr=subprocess.PIPE)
+        try:
+            with tarfile.open(fileobj=process.stdin, mode='w|') as archive:
+                for name in names:
+                    archive.add(os.path.join(self.build_dir, name),
+                                arcname=name, recursive=False)
+            process.stdin.close()
+        except (OSError, tarfile.TarError) as err:
+            process.kill()
+            process.wait()
+            logging.warning('%s: failed to stage tests: %s', target, err)
+            return False
+
+        error = process.stderr.read().decode(errors='replace').strip()
+        if process.wait() != 0:
+            logging.warning('%s: failed to stage tests: %s', target, error)
+            return False
+        return True
+
+    @traced('stage tests', 'share')
+    def _stage_tests(self):
+        subdirs = self._subdirs() if self.subdir else None
+        names = []
+        size = 0
+        for name in iter_staged(self.build_dir, subdirs):
+            status = os.lstat(os.path.join(self.build_dir, name))
+            if self.staged_files.get(name) != status.st_mtime_ns:
+                names.append(name)
+                size += status.st_size
+                self.staged_files[name] = status.st_mtime_ns
 
-        return command
+        targets = [target for target in self.targets
+                   if target.staged is not False]
+        if not names or not targets:
+            return
+
+        logging.info('staging %d files (%.1f MiB) to %s on %d targets',
+                     len(names), size / (1 << 20), STAGE_DIR, len(targets))
+        with ThreadPoolExecutor(max_workers=len(targets)) as executor:
+            staged = list(executor.map(
+                lambda target: self._stage_target(target, names), targets))
 
-    def _run_make(self, args):
+        # a target which failed once runs all tests from the share, it would
+        # miss the files of the previous stagings otherwise
+        for target, success in zip(targets, staged):
+            target.staged = success
+            target.test_wrapper = self._test_wrapper_command(target)
+
+    def _run_make(self, args, jobserver=None):
         make_command = 'make {}'.format(' '.join(args))
+        env = self.env
+        pass_fds = ()
+        if jobserver is not None:
+            env = dict(self.env or {}, MAKEFLAGS=jobserver.makeflags())
+            pass_fds = jobserver.fds()
         return run_command(args=make_command,
                            cwd=self.build_dir,
-                           env=self.env,
+                           env=env,
                            shell=True,
-                           verbose=self.verbose)
+                           verbose=self.verbose,
+                           pass_fds=pass_fds)
 
-    def _run_tests(self, test_wrapper_cmd):
-        for option in self.make_options:
-            make_args = [
-                '-i',
-                'test-wrapper=\'{}\''.format(' '.join(test_wrapper_cmd)),
-                f'PARALLELMFLAGS=-j{self.test_jobs}',
-                option
-            ]
+    def _build_tests(self, option, subdir=None):
+        make_args = [
+            '-i',
+            'run-built-tests=no',
+            f'PARALLELMFLAGS=-j{self.build_jobs}',
+            option
+        ]
 
-            if self.subdir:
-                make_args.append(f'subdirs={self.subdir}')
+        if subdir:
+            make_args.append(f'subdirs={shlex.quote(subdir)}')
 
+        logging.info('building tests for %s with %d jobs',
+                     option, self.build_jobs)
+        with span('build tests', 'build', option=option):
             self._run_make(make_args)
 
+    def _run_check(self, test_wrapper_cmd, option, subdir=None,
+                   jobserver=None):
+        make_args = [
+            '-i',
+            'test-wrapper=\'{}\''.format(' '.join(test_wrapper_cmd)),
+            option
+        ]
+
+        # -j of PARALLELMFLAGS would start a jobserver of its own
+        if jobserver is None:
+            make_args.insert(2, f'PARALLELMFLAGS=-j{self.test_jobs}')
+
+        if subdir:
+            make_args.append(f'subdirs={shlex.quote(subdir)}')
+
+        with span(option, 'test', subdir=subdir or 'all'):
+            self._run_make(make_args, jobserver)
+
+    def _subdirs(self):
+        if self.subdir:
+            return self.subdir.split()
+
+        sorted_subdirs = os.path.join(self.build_dir, 'sysd-sorted')
+        try:
+            with open(sorted_subdirs) as sysd_sorted:
+                for line in sysd_sorted:
+                    name, _, value = line.partition(':=')
+                    if name.strip() == 'sorted-subdirs':
+                        return value.split()
+        except OSError as err:
+            raise GlibcTestSuiteError(f'Failed to read subdirs list: {err}')
+
+        raise GlibcTestSuiteError(
+            f'No subdirs list was found in {sorted_subdirs}')
+
+    def _subdir_slots(self):
+        # subdirs of a target share its jobs, so that the tail of one subdir
+        # is filled with the tests of the next
+        if not self.schedule_subdirs:
+            return 1
+        return min(SUBDIRS_PER_TARGET, self.test_jobs)
+
+    def _run_worker(self, target, option, subdirs, jobserver):
+        while True:
+            try:
+                subdir = subdirs.get_nowait()
+            except queue.Empty:
+                return
+
+            logging.info('%s: running %s for %s',
+                         target or 'local', option, subdir)
+            start = time.monotonic()
+            if target is None:
+                self._run_check(self.test_wrapper, option, subdir, jobserver)
+            elif not self._run_on_target(target, option, subdir, jobserver):
+                # the target was dropped, the subdir is left to the others
+                subdirs.put(subdir)
+                return
+            if not self.rerun_failed:
+                self.history.record_subdir(subdir, time.monotonic() - start)
+
+    def _merge_results(self, option, subdirs):
+        summary = 'tests.sum' if option == 'check' else 'xtests.sum'
+        subdir_summary = f'subdir-{summary}'
+        if os.path.isfile(os.path.join(self.build_dir, subdir_summary)):
+            subdirs = subdirs + ['.']
+
+        args = [
+            os.path.join(self.glibc_dir, 'scripts', 'merge-test-results.sh'),
+            '-t', self.build_dir + os.sep, subdir_summary
+        ] + sorted(subdirs)
+
+        logging.info('merging results into %s', summary)
+        with open(os.path.join(self.build_dir, summary), 'w') as output:
+            subprocess.run(args, stdout=output, check=True)
+
+    def _run_scheduled(self, option):
+        subdirs = self.history.order_subdirs(self._subdirs())
+        pending = queue.Queue()
+        for subdir in subdirs:
+            pending.put(subdir)
+
+        # subdirs of a dropped target may be put back after the other
+        # workers have finished
+        while not pending.empty():
+            targets = [target for target in self.targets
+                       if not target.dropped] or [None]
+            slots = self._subdir_slots()
+            jobservers = [Jobserver(self.test_jobs, slots) if slots > 1
+                          else None for _ in targets]
+            logging.info('scheduling %d subdirs on %d targets, %d at a time '
+                         'with %d jobs on each, longest first',
+                         pending.qsize(), len(targets), slots, self.test_jobs)
+            try:
+                with ThreadPoolExecutor(
+                        max_workers=len(targets) * slots) as executor:
+                    futures = [executor.submit(self._run_worker, target,
+                                               option, pending, jobserver)
+                               for target, jobserver in zip(targets,
+                                                            jobservers)
+                               for _ in range(slots)]
+                    for future in futures:
+                        future.result()
+            finally:
+                for jobserver in jobservers:
+                    if jobserver is not None:
+                        jobserver.close()
+
+        self._merge_results(option, subdirs)
+
+    def _run_tests(self):
+        # a single make run keeps the makefile order; subdirs are split
+        # across several targets, or scheduled on their own on request
+        scheduled = len(self.targets) > 1 or self.schedule_subdirs
+
+        for option in self.make_options:
+            self._build_tests(option, self.subdir)
+            if self.stage_tests and self.targets:
+                self._stage_tests()
+
+            logging.info('running tests for %s with %d jobs',
+                         option, self.test_jobs)
+            progress = Progress(option, self.build_dir,
+                                self._subdirs() if self.subdir else None,
+                                self.history, self.progress_file,
+                                live=sys.stderr.isatty() and not self.verbose)
+            progress.start()
+            try:
+                if scheduled:
+                    self._run_scheduled(option)
+                elif self.targets:
+                    self._run_on_target(self.targets[0], option, self.subdir)
+                else:
+                    self._run_check(self.test_wrapper, option, self.subdir)
+            finally:
+                progress.stop()
+
+    def _remove_durations(self, tests):
+        try:
+            with open(self.durations_path) as durations:
+                records = durations.readlines()
+        except FileNotFoundError:
+            return
+
+        with open(self.durations_path, 'w') as durations:
+            for record in records:
+                try:
+                    test = json.loads(record)['test']
+                except (ValueError, KeyError):
+                    continue
+                if test not in tests:
+                    durations.write(record)
+
+    def _invalidate_failed(self):
+        subdirs = self._subdirs() if self.subdir else None
+        results = TestResults.collect(self.build_dir, subdirs)
+        failed = [result for result in results.results
+                  if result.status in RERUN_STATUSES]
+
+        for result in failed:
+            logging.info('rerunning %s: %s', result.status, result.name)
+            for suffix in ['.out', '.test-result']:
+                path = os.path.join(self.build_dir, result.name + suffix)
+                if os.path.exists(path):
+                    os.unlink(path)
+
+        self._remove_durations({result.name for result in failed})
+
+        return failed
+
+    @traced('collect results', 'test')
+    def _collect_results(self):
+        subdirs = self._subdirs() if self.subdir else None
+        results = TestResults.collect(self.build_dir, subdirs,
+                                      self.durations_path)
+
+        for failure in results.failures():
+            logging.info('%s: %s', failure.status, failure.name)
+
+        counts = results.counts()
+        logging.info('test results: %s', ', '.join(
+            f'{status} {count}' for status, count in sorted(counts.items())))
+
+        try:
+            results.write_json(self.json_report)
+            results.write_junit(self.junit_report)
+        except OSError as err:
+            raise GlibcTestSuiteError(f'Failed to write test reports: {err}')
+        logging.info('test reports: %s, %s', self.json_report,
+                     self.junit_report)
+
+        if self.timeouts_path:
+            self._report_timeouts()
+
+        return results
+
+    def _sources(self):
+        sources = {}
+        for root, dirs, files in os.walk(self.glibc_dir):
+            if root == self.glibc_dir:
+                dirs[:] = [name for name in dirs
+                           if name != '.git' and not name.startswith('build')]
+            for name in files:
+                if name.endswith('.c'):
+                    sources.setdefault(name[:-2], []).append(
+                        os.path.join(root, name))
+        return sources
+
+    def _source_timeout(self, path):
+        try:
+            with open(path, errors='replace') as source:
+                match = TIMEOUT_DEFINE.search(source.read())
+        except OSError:
+            return None
+        if match is None:
+            return TEST_TIMEOUT
+        value = match.group(1).strip('() ')
+        return int(value) if value.isdigit() else None
+
+    def _test_timeout(self, test, sources):
+        # sources of the test's subdir are preferred to the sysdeps ones with
+        # the same name; of several candidates the shortest TIMEOUT is taken
+        subdir, _, name = test.rpartition('/')
+        paths = sources.get(name, [])
+        prefix = os.path.join(self.glibc_dir, subdir) + os.sep
+        paths = [path for path in paths if path.startswith(prefix)] or paths
+
+        timeouts = [self._source_timeout(path) for path in paths]
+        if not timeouts or None in timeouts:
+            return None
+        return min(timeouts)
+
+    def _write_timeouts(self):
+        sources = self._sources()
+        timeouts = {}
+        for test in self.history.tests:
+            # tests whose TIMEOUT isn't known keep --timeoutfactor
+            timeout = self._test_timeout(test, sources)
+            if timeout is None:
+                continue
+            self.test_timeouts[test] = timeout
+            budget = self.history.timeout_budget(test, TIMEOUT_MULTIPLIER,
+                                                 TIMEOUT_FLOOR)
+            factor = math.ceil(budget / timeout)
+            if factor < self.timeoutfactor:
+                timeouts[test] = factor
+
+        path = os.path.join(self.wrapper_dir, 'timeouts.json')
+        with open(path, 'w') as timeouts_file:
+            json.dump(timeouts, timeouts_file, separators=(',', ':'))
+
+        logging.info('adaptive timeouts: %d of %d tests with history get a '
+                     'lower timeout factor than %d', len(timeouts),
+                     len(self.history.tests), self.timeoutfactor)
+        return path
+
+    def _report_timeouts(self):
+        saved = 0
+        timed_out = 0
+        for record in iter_duration_records(self.durations_path):
+            factor = record.get('timeoutfactor')
+            timeout = self.test_timeouts.get(record['test'])
+            if not factor or not timeout or not record['exitcode'] or \
+                    record['duration'] < factor * timeout:
+                continue
+            timed_out += 1
+            saved += (self.timeoutfactor - factor) * timeout
+
+        logging.info('adaptive timeouts: %d tests reached their budget, '
+                     'up to %.0fs of wall time saved', timed_out, saved)
+
+    def _needs_targets(self):
+        return not self.qemu_user or self.qemu_path or self.nsim_propsfile
+
+    def _skip_stage(self, stage, stage_digest, outputs):
+        if self.force_stages or \
+                not self.fingerprints.unchanged(stage, stage_digest, outputs):
+            self.fingerprints.invalidate(stage)
+            return False
+
+        logging.info('%s: inputs and outputs are unchanged, skipping', stage)
+        return True
+
+    def _configure_digest(self, args):
+        env = self.env or {}
+        compilers = [fingerprint.program_state(f'{self.toolchain_prefix}-{tool}',
+                                               env)
+                     for tool in ['gcc', 'g++']]
+        headers = None
+        if self.linux_headers_dir:
+            headers = fingerprint.tree_state(
+                os.path.join(self.linux_headers_dir, 'usr', 'include'))
+
+        return fingerprint.digest(
+            args,
+            {name: env.get(name) for name in ['CC', 'CXX', 'CFLAGS', 'CXXFLAGS']},
+            compilers,
+            headers,
+            self.source_state,
+            utils.file_hash(os.path.join(self.glibc_dir, 'configure')))
+
+    def _build_digest(self):
+        # without a git revision the sources can't be fingerprinted cheaply
+        if self.source_state is None:
+            return None
+        return fingerprint.digest(self.fingerprints.get('configure'),
+                                  self.source_state)
+
+    @traced('configure', 'build')
     def configure(self):
         args = [
             f'{self.glibc_dir}/configure',
@@ -266,6 +1267,12 @@ class GlibcTestSuite:
             args.append(f'--enable-kernel={self.linux_headers_version}')
 
         mkdir(self.build_dir)
+        stage_digest = self._configure_digest(args)
+        outputs = [os.path.join(self.build_dir, name)
+                   for name in ['config.make', 'config.status']]
+        if self._skip_stage('configure', stage_digest, outputs):
+            return
+
         try:
             run_command(args=args,
                         cwd=self.build_dir,
@@ -273,14 +1280,28 @@ class GlibcTestSuite:
                         verbose=self.verbose)
         except subprocess.CalledProcessError as err:
             raise GlibcTestSuiteError(err)
+        self.fingerprints.update('configure', stage_digest)
 
+    @traced('build', 'build')
     def build(self):
+        stage_digest = self._build_digest()
+        outputs = [os.path.join(self.build_dir, 'libc.so')]
+        if self._skip_stage('build', stage_digest, outputs):
+            return
+
         try:
             self._run_make([f'PARALLELMFLAGS=-j{self.build_jobs}'])
         except subprocess.CalledProcessError as err:
             raise GlibcTestSuiteError(err)
+        self.fingerprints.update('build', stage_digest)
 
+    @traced('install', 'build')
     def install(self):
+        stage_digest = self.fingerprints.get('build')
+        outputs = [os.path.join(self.install_dir, 'lib', 'libc.so.6')]
+        if self._skip_stage('install', stage_digest, outputs):
+            return
+
         try:
             self._run_make(['install'])
 
@@ -288,27 +1309,289 @@ class GlibcTestSuite:
                 self._install_library(library)
         except subprocess.CalledProcessError as err:
             raise GlibcTestSuiteError(err)
+        self.fingerprints.update('install', stage_digest)
 
-    def run(self):
-        ssh_cmd = ''
+    def _lease_targets(self):
+        try:
+            self.lease = GuestLease(self.server_socket, self.emulators)
+        except ServerError as err:
+            raise GlibcTestSuiteError(err)
+
+        if self.lease.glibc_dir != self.glibc_dir:
+            raise GlibcTestSuiteError(
+                f'Guests of {self.server_socket} have '
+                f'{self.lease.glibc_dir} mounted, not {self.glibc_dir}')
+        self.leased_emulator = self.lease.emulator
+        self.targets = [Target(hostname, port)
+                        for hostname, port in self.lease.targets]
+        logging.info('leased %s from %s',
+                     ', '.join(str(target) for target in self.targets),
+                     self.server_socket)
+
+    def _setup_target(self, target):
+        if self.lease is None:
+            nfsport, mountport = self.nfs_ports
+            self._mount_share(target, self.glibc_dir, nfsport, mountport)
+        if self.ssh_multiplexing:
+            self._start_ssh_master(target)
+        target.ssh_cmd = self._create_ssh_wrapper(target)
+        target.test_wrapper = self._test_wrapper_command(target)
+
+    def _start_watchdog(self, target):
+        if target.emulator is not None:
+            # let oopses and OOM kills through to the console
+            target.emulator.run('dmesg -n 4')
+
+        probe = ['ssh'] + self._ssh_options(target) + [
+            '-o', 'ConnectTimeout=30', f'root@{target.hostname}', 'true'
+        ]
+        target.watchdog = Watchdog(target, probe)
+        target.watchdog.start()
+
+    def _drop_target(self, target):
+        if all(other.dropped or other is target for other in self.targets):
+            raise GlibcTestSuiteError(
+                f'{target}: guest failed and no other targets are left')
+
+        logging.error('%s: dropping the target: %s', target, target.crash)
+        target.dropped = True
+        # removing the SSH wrapper makes the queued tests fail at once
+        target.stop()
+
+    @traced('restart target', 'emulator')
+    def _recover_target(self, target):
+        with target.lock:
+            if target.dropped:
+                return False
+            if target.crash is None:
+                return True
+
+            target.restarts += 1
+            if target.restarts > MAX_RESTARTS or \
+                    not self.qemu_path and not self.nsim_propsfile:
+                self._drop_target(target)
+                return False
+
+            logging.info('%s: restarting the guest', target)
+            index = self.targets.index(target)
+            target.stop()
+            try:
+                target.emulator = self._boot_emulator(index, target)
+                self._setup_target(target)
+
+                if target.staged:
+                    target.staged = self._stage_target(
+                        target, list(self.staged_files))
+                    target.test_wrapper = self._test_wrapper_command(target)
+
+                self._start_watchdog(target)
+            except (GlibcTestSuiteError, EmulatorError) as err:
+                target.crash = f'restart failed: {err}'
+                self._drop_target(target)
+                return False
+
+            target.crash = None
+            return True
+
+    def _mark_crashed(self, target, crash_time, reason, subdir=None):
+        subdirs = subdir.split() if subdir else None
+        for record in iter_duration_records(self.durations_path):
+            test = record['test']
+            if record.get('target') != str(target) or \
+                    record.get('end', 0) < crash_time:
+                continue
+            if subdirs is not None and test.split('/', 1)[0] not in subdirs:
+                continue
+
+            path = os.path.join(self.build_dir, test)
+            if record['end'] - record['duration'] >= crash_time:
+                # started on the failed guest, make runs it again
+                for suffix in ['.out', '.test-result']:
+                    if os.path.exists(path + suffix):
+                        os.unlink(path + suffix)
+                continue
+
+            logging.error('%s: %s was interrupted by the guest failure',
+                          target, test)
+            with open(f'{path}.out', 'a') as output:
+                output.write(f'\nguest failure: {reason}\n')
+            with open(f'{path}.test-result', 'w') as result:
+                result.write(f'CRASH: {test}\n')
+
+    def _run_on_target(self, target, option, subdir=None, jobserver=None):
+        while True:
+            if target.crash is not None and not self._recover_target(target):
+                return False
+
+            crashes = target.crashes
+            self._run_check(target.test_wrapper, option, subdir, jobserver)
+            if target.crashes == crashes:
+                return True
+
+            # the tests without results are run again on the restarted guest
+            self._mark_crashed(target, target.crash_time, target.crash, subdir)
+
+    @traced('startup')
+    def start(self):
+        start = time.monotonic()
+        self.stopping = False
+        mkdir(self.build_dir)
+        self.wrapper_dir = tempfile.mkdtemp(prefix='test-wrapper-')
+
+        if self.server_socket:
+            self._lease_targets()
+            self._load_history()
+        elif self._needs_targets():
+            if self.unfs_path and self.share == 'nfs':
+                self.nfs_ports = self._run_nfs_server()
+            self._start_targets()
+
+        if self.adaptive_timeouts:
+            self.timeouts_path = self._write_timeouts()
+
+        for target in list(self.targets):
+            try:
+                self._setup_target(target)
+            except GlibcTestSuiteError as err:
+                if target.emulator is not None or len(self.targets) == 1:
+                    raise
+                logging.error('%s: dropping the board: %s', target, err)
+                target.stop()
+                self.targets.remove(target)
+
+        if not self.targets:
+            self.test_wrapper = self._test_wrapper_command(None)
+
+        if self.auto_tune and self.targets:
+            self._auto_tune_test_jobs()
+
+        if self.watchdog:
+            for target in self.targets:
+                self._start_watchdog(target)
+
+        return time.monotonic() - start
+
+    def start_in_background(self):
+        logging.info('starting NFS server and emulators in background')
+        self.start_executor = ThreadPoolExecutor(max_workers=1)
+        self.start_future = self.start_executor.submit(self.start)
+
+    def _wait_started(self):
+        if self.start_future is None:
+            self.start()
+            return
+
+        wait_start = time.monotonic()
         try:
-            nfsport = mountport = 0
-            if self.unfs_path:
-                nfsport, mountport = self._run_nfs_server()
+            startup = self.start_future.result()
+        finally:
+            self.start_executor.shutdown()
+            self.start_executor = self.start_future = None
+
+        waited = time.monotonic() - wait_start
+        logging.info('emulator startup took %.1fs, %.1fs of it overlapped '
+                     'with the build', startup, max(0.0, startup - waited))
+
+    def stop(self):
+        with self.boot_lock:
+            self.stopping = True
+            for emulator in self.booting:
+                emulator.stop()
+
+        if self.start_future is not None:
+            self.start_executor.shutdown()
+            self.start_executor = self.start_future = None
+
+        if self.unfs:
+            self.unfs.stop()
+            self.unfs = None
 
-            if self.qemu_path:
-                self._run_qemu()
+        for target in self.targets:
+            target.stop()
+        self.targets = []
 
-            if self.nsim_propsfile:
-                self._run_nsim()
+        if self.lease is not None:
+            self.lease.close()
+            self.lease = None
 
-            self._mount_nfs(self.glibc_dir, nfsport, mountport)
-            ssh_cmd = self._create_ssh_wrapper()
-            test_wrapper_cmd = self._test_wrapper_command(ssh_cmd)
-            self._run_tests(test_wrapper_cmd)
+        for server in self.share_servers:
+            server.stop()
+        self.share_servers = []
+
+        if self.tap_pool:
+            self.tap_pool.stop()
+
+        if self.wrapper_dir:
+            rmtree(self.wrapper_dir, ignore_errors=True)
+            self.wrapper_dir = None
+
+    def serve(self, path, idle_timeout):
+        if not self.qemu_path and not self.nsim_propsfile:
+            raise GlibcTestSuiteError(
+                'Only QEMU and nSIM guests can be served')
+
+        # the watchdogs find failed guests, the server restarts them
+        self.watchdog = True
+        try:
+            # no guests are booted when another server is running
+            remove_stale_socket(path)
+            self.start()
+            server = GuestServer(self.targets, self._recover_target,
+                                 self.glibc_dir, self._emulator_name(), path,
+                                 idle_timeout)
+            server.serve()
+        except KeyboardInterrupt:
+            logging.info('guest server was interrupted')
+        except ServerError as err:
+            raise GlibcTestSuiteError(err)
+        except OSError as err:
+            raise GlibcTestSuiteError(f'Failed to serve guests on {path}: '
+                                      f'{err}')
         finally:
-            if self.unfs:
-                self.unfs.stop()
+            self.stop()
 
-            if ssh_cmd:
-                os.unlink(ssh_cmd)
+    def run(self):
+        rerun_subdirs = None
+        rerun_tests = None
+        if self.rerun_failed:
+            failed = self._invalidate_failed()
+            if not failed:
+                logging.info('no failed tests to rerun')
+                self.stop()
+                return self._collect_results()
+            # make reruns only the tests without results; the subdirs list
+            # just spares it walking the others, top-level tests run anyway
+            rerun_subdirs = sorted({result.subdir for result in failed} - {'.'})
+            rerun_tests = {result.name for result in failed}
+
+        try:
+            self._wait_started()
+
+            if rerun_subdirs:
+                subdir, self.subdir = self.subdir, ' '.join(rerun_subdirs)
+                try:
+                    self._run_tests()
+                finally:
+                    self.subdir = subdir
+                # make wrote the summaries of the rerun subdirs only
+                for option in self.make_options:
+                    self._merge_results(option, self._subdirs())
+            elif self.rerun_failed:
+                self._run_tests()
+            else:
+                open(self.durations_path, 'w').close()
+                self._run_tests()
+            results = self._collect_results()
+
+            self.history.record_tests(results, rerun_tests)
+            try:
+                self.history.save()
+            except OSError as err:
+                logging.warning('Failed to save duration history: %s', err)
+
+            if self.run_db:
+                self._record_run(results)
+
+            return results
+        finally:
+            self.stop()
@@ -0,0 +1,117 @@
+import json
+import logging
+import math
+import os
+import statistics
+import tempfile
+import threading
+
+
+class DurationHistory:
+    SAMPLES = 10
+
+    def __init__(self, path, configuration):
+        self.path = path
+        # durations of another emulator or CPU tell nothing about this one
+        self.key = json.dumps(configuration, sort_keys=True)
+        self.subdirs = {}
+        self.tests = {}
+        self.measured = set()
+        self.lock = threading.Lock()
+        self._load()
+
+    def _read(self):
+        try:
+            with open(self.path) as history_file:
+                history = json.load(history_file)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as err:
+            logging.warning('Ignoring duration history %s: %s', self.path, err)
+            return {}
+
+        configurations = history.get('configurations')
+        return configurations if isinstance(configurations, dict) else {}
+
+    def _load(self):
+        history = self._read().get(self.key, {})
+        self.subdirs = history.get('subdirs', {})
+        self.tests = history.get('tests', {})
+
+    def _add_sample(self, samples, name, duration):
+        samples[name] = (samples.get(name, []) + [duration])[-self.SAMPLES:]
+
+    def record_subdir(self, subdir, duration):
+        with self.lock:
+            self._add_sample(self.subdirs, subdir, round(duration, 3))
+            self.measured.add(subdir)
+
+    def record_tests(self, results, tests=None):
+        # a rerun measures only some tests of their subdirs
+        totals = {}
+        with self.lock:
+            for result in results.results:
+                if result.duration is None or \
+                        tests is not None and result.name not in tests:
+                    continue
+                self._add_sample(self.tests, result.name, result.duration)
+                totals[result.subdir] = \
+                    totals.get(result.subdir, 0.0) + result.duration
+
+            # subdirs which were not run on their own are estimated by the
+            # total time of their tests
+            for subdir, duration in totals.items():
+                if subdir not in self.measured and tests is None:
+                    self._add_sample(self.subdirs, subdir, round(duration, 3))
+
+    def seed(self, tests):
+        # estimates of a fresh history from the runs of another build tree
+        totals = {}
+        with self.lock:
+            for test, samples in tests.items():
+                self.tests[test] = samples[-self.SAMPLES:]
+                subdir = test.split('/', 1)[0] if '/' in test else '.'
+                totals[subdir] = totals.get(subdir, 0.0) + samples[-1]
+            for subdir, duration in totals.items():
+                self.subdirs.setdefault(subdir, [round(duration, 3)])
+
+    def subdir_estimate(self, subdir):
+        samples = self.subdirs.get(subdir)
+        return statistics.median(samples) if samples else None
+
+    def test_samples(self, test):
+        return self.tests.get(test, [])
+
+    def timeout_budget(self, test, multiplier, floor):
+        samples = sorted(self.tests.get(test, []))
+        if not samples:
+            return None
+        # nearest-rank p99, which is the longest sample of a short history
+        p99 = samples[math.ceil(0.99 * len(samples)) - 1]
+        return max(floor, multiplier * p99)
+
+    def order_subdirs(self, subdirs):
+        # longest processing time first; subdirs without history are started
+        # first so that they can't end up as the long tail of the run
+        def key(subdir):
+            estimate = self.subdir_estimate(subdir)
+            return float('inf') if estimate is None else estimate
+
+        return sorted(subdirs, key=key, reverse=True)
+
+    def save(self):
+        configurations = self._read()
+        configurations[self.key] = {'subdirs': self.subdirs,
+                                    'tests': self.tests}
+        history = {'configurations': configurations}
+        # runs sharing a history must not write the same temporary file
+        fd, temp_path = tempfile.mkstemp(
+            dir=os.path.dirname(os.path.abspath(self.path)),
+            prefix=f'{os.path.basename(self.path)}.')
+        try:
+            with os.fdopen(fd, 'w') as history_file:
+                json.dump(history, history_file, separators=(',', ':'))
+            os.replace(temp_path, self.path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
@@ -0,0 +1,65 @@
+import json
+import re
+
+CONFIGURATION_NAME = re.compile(r'^[\w.-]+$')
+
+
+class MatrixError(Exception):
+    pass
+
+
+def load_matrix(path, options):
+    try:
+        with open(path) as matrix_file:
+            matrix = json.load(matrix_file)
+    except (OSError, ValueError) as err:
+        raise MatrixError(f'Cannot read configuration matrix {path}: {err}')
+
+    if not isinstance(matrix, list) or not matrix:
+        raise MatrixError(f'{path} must contain a list of configurations')
+
+    names = set()
+    for configuration in matrix:
+        name = configuration.get('name')
+        if not isinstance(name, str) or not CONFIGURATION_NAME.match(name):
+            raise MatrixError(f'Invalid configuration name: {name}')
+        if name in names:
+            raise MatrixError(f'Duplicate configuration name: {name}')
+        names.add(name)
+
+        unknown = set(configuration) - set(options) - {'name'}
+        if unknown:
+            raise MatrixError(f'{name}: unknown options: '
+                              f'{", ".join(sorted(unknown))}')
+    return matrix
+
+
+def comparison_table(results):
+    names = list(results)
+    width = max([len(name) for name in names] + [8])
+
+    statuses = sorted({status for name in names
+                       for status in results[name].counts()})
+    lines = [f'{"config":<{width}} ' +
+             ' '.join(f'{status:>11}' for status in statuses)]
+    for name in names:
+        counts = results[name].counts()
+        lines.append(f'{name:<{width}} ' +
+                     ' '.join(f'{counts[status]:>11}' for status in statuses))
+
+    tests = {}
+    for name in names:
+        for result in results[name].results:
+            tests.setdefault(result.name, {})[name] = result.status
+
+    differences = [(test, by_config) for test, by_config in sorted(tests.items())
+                   if len(set(by_config.get(name) for name in names)) > 1]
+    if differences:
+        test_width = max(len(test) for test, _ in differences)
+        lines.append('')
+        lines.append(f'{"test":<{test_width}} ' +
+                     ' '.join(f'{name:>{width}}' for name in names))
+        for test, by_config in differences:
+            lines.append(f'{test:<{test_width}} ' + ' '.join(
+                f'{by_config.get(name, "-"):>{width}}' for name in names))
+    return lines
@@ -0,0 +1,176 @@
+import json
+import logging
+import os
+import statistics
+import sys
+import threading
+import time
+from collections import Counter
+from testsuite.results import PASSING_STATUSES, iter_test_result_paths, \
+    read_test_result
+
+CLEAR_LINE = '\r\x1b[K'
+
+
+def _format_duration(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f'{hours}h{minutes:02d}m' if hours else f'{minutes}m{seconds:02d}s'
+
+
+class _ClearLine(logging.Filter):
+    # log messages would be appended to the progress line otherwise, the line
+    # is drawn again on the next update
+    def __init__(self, stream):
+        super().__init__()
+        self.stream = stream
+
+    def filter(self, record):
+        self.stream.write(CLEAR_LINE)
+        return True
+
+
+class Progress(threading.Thread):
+    def __init__(self, option, build_dir, subdirs, history, path=None,
+                 live=False, interval=2, log_interval=60):
+        super().__init__(name=f'progress {option}', daemon=True)
+        self.option = option
+        # configurations of a matrix are told apart by their build dirs
+        name = os.path.basename(build_dir)
+        self.label = option if name == 'build' else f'{name} {option}'
+        self.build_dir = build_dir
+        self.subdirs = subdirs
+        self.path = path
+        self.live = live
+        self.interval = interval
+        self.log_interval = log_interval
+        self.stopped = threading.Event()
+        self.stream = sys.stderr
+        self.filter = _ClearLine(self.stream)
+
+        # tests of the scope with their expected durations
+        prefixes = tuple(f'{subdir}/' for subdir in subdirs or [])
+        self.expected = {}
+        for test in list(history.tests):
+            if not prefixes or test.startswith(prefixes):
+                samples = history.test_samples(test)
+                self.expected[test] = statistics.median(samples) \
+                    if samples else 0.0
+
+        # results of previous runs are left for the tests make doesn't rerun
+        self.previous = self._scan()
+        self.seen = {}
+        self.completed = set()
+        self.counts = Counter()
+        self.started = time.monotonic()
+
+    def _scan(self):
+        mtimes = {}
+        for path in iter_test_result_paths(self.build_dir, self.subdirs):
+            try:
+                mtimes[path] = os.stat(path).st_mtime_ns
+            except OSError:
+                continue
+        return mtimes
+
+    def _update(self):
+        for path, mtime in self._scan().items():
+            if mtime == self.previous.get(path) or \
+                    mtime == self.seen.get(path):
+                continue
+            result = read_test_result(path)
+            if result is None:
+                # written just now, it's read on the next update
+                continue
+            self.seen[path] = mtime
+            if result.name in self.completed:
+                continue
+            self.completed.add(result.name)
+            self.counts['PASS' if result.status == 'PASS' else
+                        'FAIL' if result.status not in PASSING_STATUSES else
+                        result.status] += 1
+
+    def status(self):
+        elapsed = time.monotonic() - self.started
+        completed = len(self.completed)
+        total = len(self.expected) or None
+        if total is not None and completed > total:
+            total = None
+
+        rate = completed * 60 / elapsed if elapsed > 0 else 0.0
+        # the history tells how long the rest takes compared to the tests
+        # which are done, whatever the number of jobs and targets is
+        done = sum(self.expected.get(test, 0.0) for test in self.completed)
+        remaining = sum(duration for test, duration in self.expected.items()
+                        if test not in self.completed)
+        if done > 0:
+            eta = elapsed * remaining / done
+        elif total is not None and rate > 0:
+            eta = (total - completed) * 60 / rate
+        else:
+            eta = None
+
+        return {
+            'option': self.option,
+            'completed': completed,
+            'total': total,
+            'counts': dict(self.counts),
+            'tests_per_minute': round(rate, 1),
+            'elapsed': round(elapsed, 1),
+            'eta': None if eta is None else round(eta, 1),
+            'updated': time.time()
+        }
+
+    def _line(self, status):
+        completed = status['completed']
+        done = f'{completed}/{status["total"]}' if status['total'] else \
+            str(completed)
+        eta = 'unknown' if status['eta'] is None else \
+            _format_duration(status['eta'])
+        return (f'{self.label}: {done} tests, '
+                f'{status["counts"].get("PASS", 0)} PASS, '
+                f'{status["counts"].get("FAIL", 0)} FAIL, '
+                f'{status["tests_per_minute"]} tests/min, ETA {eta}')
+
+    def _write(self, status, finished=False):
+        if self.path is None:
+            return
+        temp_path = f'{self.path}.tmp'
+        try:
+            with open(temp_path, 'w') as progress_file:
+                json.dump(dict(status, finished=finished), progress_file,
+                          separators=(',', ':'))
+            os.replace(temp_path, self.path)
+        except OSError as err:
+            logging.warning('Failed to write progress file: %s', err)
+            self.path = None
+
+    def run(self):
+        if self.live:
+            for handler in logging.getLogger().handlers:
+                handler.addFilter(self.filter)
+
+        next_log = time.monotonic() + self.log_interval
+        while not self.stopped.wait(self.interval):
+            self._update()
+            status = self.status()
+            self._write(status)
+            if self.live:
+                self.stream.write(CLEAR_LINE + self._line(status))
+                self.stream.flush()
+            elif time.monotonic() >= next_log:
+                logging.info('%s', self._line(status))
+                next_log = time.monotonic() + self.log_interval
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+        if self.live:
+            self.stream.write(CLEAR_LINE)
+            for handler in logging.getLogger().handlers:
+                handler.removeFilter(self.filter)
+
+        self._update()
+        status = self.status()
+        self._write(status, finished=True)
+        logging.info('%s', self._line(status))
@@ -0,0 +1,165 @@
+import json
+import os
+import re
+import xml.etree.ElementTree as ElementTree
+from collections import Counter
+from typing import Dict, Iterator, List, NamedTuple, Optional
+
+PASSING_STATUSES = ('PASS', 'XPASS', 'XFAIL', 'UNSUPPORTED')
+OUTPUT_TAIL_SIZE = 4096
+# characters which are not allowed in XML 1.0 documents
+XML_INVALID_CHARS = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+
+class TestResult(NamedTuple):
+    name: str
+    status: str
+    subdir: str
+    duration: Optional[float] = None
+
+
+def _scan_test_results(path: str) -> Iterator[str]:
+    try:
+        entries = list(os.scandir(path))
+    except OSError:
+        return
+
+    for entry in entries:
+        if entry.is_dir(follow_symlinks=False):
+            yield from _scan_test_results(entry.path)
+        elif entry.name.endswith('.test-result'):
+            yield entry.path
+
+
+def iter_test_result_paths(build_dir: str,
+                           subdirs: Optional[List[str]] = None
+                           ) -> Iterator[str]:
+    for subdir in subdirs or ['']:
+        yield from _scan_test_results(os.path.join(build_dir, subdir))
+
+
+def read_test_result(path: str,
+                     durations: Optional[Dict[str, float]] = None
+                     ) -> Optional[TestResult]:
+    try:
+        with open(path) as result_file:
+            line = result_file.readline()
+    except OSError:
+        return None
+
+    status, _, name = line.strip().partition(': ')
+    if not name:
+        return None
+    subdir = name.split('/', 1)[0] if '/' in name else '.'
+    return TestResult(name, status, subdir, (durations or {}).get(name))
+
+
+def iter_test_results(build_dir: str,
+                      subdirs: Optional[List[str]] = None,
+                      durations: Optional[Dict[str, float]] = None
+                      ) -> Iterator[TestResult]:
+    for path in iter_test_result_paths(build_dir, subdirs):
+        result = read_test_result(path, durations)
+        if result is not None:
+            yield result
+
+
+def iter_duration_records(path: str) -> Iterator[Dict]:
+    try:
+        with open(path) as durations_file:
+            for line in durations_file:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    continue
+    except FileNotFoundError:
+        return
+
+
+def load_durations(path: str) -> Dict[str, float]:
+    durations = {}
+    for record in iter_duration_records(path):
+        name = record['test']
+        durations[name] = durations.get(name, 0.0) + record['duration']
+    return durations
+
+
+class TestResults:
+    def __init__(self, results: List[TestResult], build_dir: str = None):
+        self.results = sorted(results)
+        self.build_dir = build_dir
+
+    @classmethod
+    def collect(cls, build_dir, subdirs=None, durations_path=None):
+        durations = load_durations(durations_path) if durations_path else None
+        return cls(list(iter_test_results(build_dir, subdirs, durations)),
+                   build_dir)
+
+    def counts(self) -> Counter:
+        return Counter(result.status for result in self.results)
+
+    def failures(self) -> List[TestResult]:
+        return [result for result in self.results
+                if result.status not in PASSING_STATUSES]
+
+    def exitcode(self) -> int:
+        return 1 if self.failures() else 0
+
+    def _output_tail(self, result):
+        if self.build_dir is None:
+            return None
+
+        path = os.path.join(self.build_dir, f'{result.name}.out')
+        try:
+            with open(path, 'rb') as output:
+                output.seek(0, os.SEEK_END)
+                output.seek(max(0, output.tell() - OUTPUT_TAIL_SIZE))
+                tail = output.read().decode(errors='replace')
+                return XML_INVALID_CHARS.sub('', tail)
+        except OSError:
+            return None
+
+    def write_json(self, path):
+        report = {
+            'summary': dict(self.counts()),
+            'tests': [result._asdict() for result in self.results]
+        }
+        with open(path, 'w') as report_file:
+            json.dump(report, report_file, separators=(',', ':'))
+
+    def write_junit(self, path):
+        suites = {}
+        for result in self.results:
+            suites.setdefault(result.subdir, []).append(result)
+
+        root = ElementTree.Element('testsuites')
+        for subdir, results in sorted(suites.items()):
+            suite = ElementTree.SubElement(root, 'testsuite', name=subdir)
+            counts = Counter()
+            duration = 0.0
+            for result in results:
+                case = ElementTree.SubElement(suite, 'testcase',
+                                              classname=subdir,
+                                              name=result.name)
+                if result.duration is not None:
+                    case.set('time', f'{result.duration:.3f}')
+                    duration += result.duration
+
+                if result.status == 'UNSUPPORTED':
+                    ElementTree.SubElement(case, 'skipped')
+                    counts['skipped'] += 1
+                elif result.status not in PASSING_STATUSES:
+                    kind = 'failure' if result.status == 'FAIL' else 'error'
+                    ElementTree.SubElement(case, kind, message=result.status)
+                    counts[f'{kind}s'] += 1
+                    output = self._output_tail(result)
+                    if output:
+                        ElementTree.SubElement(case, 'system-out').text = output
+
+            suite.set('tests', str(len(results)))
+            for kind in ['failures', 'errors', 'skipped']:
+                suite.set(kind, str(counts[kind]))
+            suite.set('time', f'{duration:.3f}')
+
+        ElementTree.ElementTree(root).write(path, encoding='utf-8',
+                                            xml_declaration=True)
@@ -0,0 +1,198 @@
+import os
+import sqlite3
+import time
+from typing import Dict, List, NamedTuple, Optional
+from testsuite import fingerprint
+from testsuite.results import PASSING_STATUSES, TestResults
+from utils import mkdir
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    started REAL NOT NULL,
+    configuration TEXT NOT NULL,
+    toolchain_prefix TEXT,
+    cflags TEXT,
+    cpu TEXT,
+    emulator TEXT,
+    source TEXT
+);
+CREATE INDEX IF NOT EXISTS runs_configuration ON runs (configuration, id);
+CREATE TABLE IF NOT EXISTS results (
+    run INTEGER NOT NULL REFERENCES runs (id),
+    test TEXT NOT NULL,
+    status TEXT NOT NULL,
+    duration REAL,
+    PRIMARY KEY (run, test)
+) WITHOUT ROWID;
+'''
+
+
+class RunDatabaseError(Exception):
+    pass
+
+
+class Change(NamedTuple):
+    test: str
+    old_status: Optional[str]
+    new_status: str
+    old_duration: Optional[float]
+    new_duration: Optional[float]
+
+
+class Comparison(NamedTuple):
+    base: str
+    run: int
+    new_failures: List[Change]
+    fixes: List[Change]
+    regressions: List[Change]
+
+
+def configuration_key(configuration: Dict[str, Optional[str]]) -> str:
+    return fingerprint.digest(configuration)[:16]
+
+
+def _passing(status):
+    return status in PASSING_STATUSES
+
+
+class RunDatabase:
+    def __init__(self, path):
+        self.path = path
+        try:
+            mkdir(os.path.dirname(os.path.abspath(path)))
+            # matrix configurations save their runs at the same time
+            self.db = sqlite3.connect(path, timeout=60)
+            self.db.executescript(SCHEMA)
+        except (OSError, sqlite3.Error) as err:
+            raise RunDatabaseError(f'Cannot open run database {path}: {err}')
+
+    def close(self):
+        self.db.close()
+
+    def add_run(self, configuration, results: TestResults, source=None):
+        try:
+            return self._add_run(configuration, results, source)
+        except sqlite3.Error as err:
+            raise RunDatabaseError(f'Cannot save run to {self.path}: {err}')
+
+    def _add_run(self, configuration, results, source):
+        with self.db:
+            cursor = self.db.execute(
+                'INSERT INTO runs (started, configuration, toolchain_prefix, '
+                'cflags, cpu, emulator, source) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (time.time(), configuration_key(configuration),
+                 configuration.get('toolchain_prefix'),
+                 configuration.get('cflags'), configuration.get('cpu'),
+                 configuration.get('emulator'), source))
+            run = cursor.lastrowid
+            self.db.executemany(
+                'INSERT INTO results (run, test, status, duration) '
+                'VALUES (?, ?, ?, ?)',
+                [(run, result.name, result.status, result.duration)
+                 for result in results.results])
+        return run
+
+    def runs(self, limit=20):
+        statuses = ', '.join('?' * len(PASSING_STATUSES))
+        return self.db.execute(
+            'SELECT id, started, toolchain_prefix, cflags, cpu, emulator, '
+            '(SELECT COUNT(*) FROM results WHERE run = id), '
+            '(SELECT COUNT(*) FROM results WHERE run = id '
+            f'AND status NOT IN ({statuses})) FROM runs ORDER BY id DESC '
+            'LIMIT ?', PASSING_STATUSES + (limit,)).fetchall()
+
+    def _run(self, run):
+        if run == 'latest':
+            row = self.db.execute(
+                'SELECT id, configuration FROM runs ORDER BY id DESC LIMIT 1'
+            ).fetchone()
+        else:
+            row = self.db.execute(
+                'SELECT id, configuration FROM runs WHERE id = ?',
+                (run,)).fetchone()
+        if row is None:
+            raise RunDatabaseError(f'No run {run} in {self.path}')
+        return row
+
+    def previous_run(self, run):
+        run, configuration = self._run(run)
+        row = self.db.execute(
+            'SELECT id FROM runs WHERE configuration = ? AND id < ? '
+            'ORDER BY id DESC LIMIT 1', (configuration, run)).fetchone()
+        if row is None:
+            raise RunDatabaseError(f'Run {run} has no previous run of the '
+                                   'same configuration')
+        return row[0]
+
+    def test_durations(self, configuration, samples):
+        rows = self.db.execute(
+            'SELECT test, duration FROM results WHERE duration IS NOT NULL '
+            'AND run IN (SELECT id FROM runs WHERE configuration = ? '
+            'ORDER BY id DESC LIMIT ?) ORDER BY run',
+            (configuration_key(configuration), samples))
+        durations = {}
+        for test, duration in rows:
+            durations.setdefault(test, []).append(duration)
+        return durations
+
+    def _base_results(self, base, run, configuration):
+        if base == 'previous':
+            # the latest earlier result of every test, so that a run of a
+            # few subdirs isn't the base of all other tests
+            return [(test, _passing(status), status, duration)
+                    for test, status, duration in self.db.execute(
+                        'SELECT test, status, duration FROM results '
+                        'JOIN (SELECT test AS latest_test, MAX(run) AS latest '
+                        'FROM results WHERE run IN (SELECT id FROM runs '
+                        'WHERE configuration = ? AND id < ?) GROUP BY test) '
+                        'ON test = latest_test AND run = latest',
+                        (configuration, run))]
+
+        if base == 'best':
+            # the best known result of every test: passing if any earlier
+            # run of the configuration passed it, with its fastest time
+            statuses = ', '.join('?' * len(PASSING_STATUSES))
+            return [(test, passed, 'PASS' if passed else status, duration)
+                    for test, passed, status, duration in self.db.execute(
+                        f'SELECT test, MAX(status IN ({statuses})), '
+                        'MIN(status), MIN(duration) FROM results '
+                        'WHERE run IN (SELECT id FROM runs '
+                        'WHERE configuration = ? AND id < ?) GROUP BY test',
+                        PASSING_STATUSES + (configuration, run))]
+
+        base, _ = self._run(base)
+        return [(test, _passing(status), status, duration)
+                for test, status, duration in self.db.execute(
+                    'SELECT test, status, duration FROM results '
+                    'WHERE run = ?', (base,))]
+
+    def compare(self, run='latest', base=None, slowdown=1.5,
+                min_duration=1.0) -> Comparison:
+        run, configuration = self._run(run)
+        if base is None:
+            self.previous_run(run)
+            base = 'previous'
+
+        previous = {}
+        for test, passed, status, duration in \
+                self._base_results(base, run, configuration):
+            previous[test] = (bool(passed), status, duration)
+
+        new_failures, fixes, regressions = [], [], []
+        for test, status, duration in self.db.execute(
+                'SELECT test, status, duration FROM results WHERE run = ? '
+                'ORDER BY test', (run,)):
+            passed, old_status, old_duration = \
+                previous.get(test, (None, None, None))
+            change = Change(test, old_status, status, old_duration, duration)
+            if passed and not _passing(status):
+                new_failures.append(change)
+            elif passed is False and _passing(status):
+                fixes.append(change)
+
+            if old_duration and duration and duration >= min_duration and \
+                    duration > old_duration * slowdown:
+                regressions.append(change)
+
+        return Comparison(str(base), run, new_failures, fixes, regressions)
@@ -0,0 +1,214 @@
+import json
+import logging
+import os
+import socket
+import threading
+import time
+
+CHECK_INTERVAL = 5
+
+
+class ServerError(Exception):
+    pass
+
+
+def _send(connection, message):
+    connection.sendall(json.dumps(message).encode() + b'\n')
+
+
+def remove_stale_socket(path):
+    # the socket of a server which has exited is left behind
+    if not os.path.exists(path):
+        return
+
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(path)
+    except OSError:
+        os.unlink(path)
+    else:
+        raise ServerError(f'A guest server is already running on {path}')
+    finally:
+        probe.close()
+
+
+class GuestServer:
+    def __init__(self, targets, recover, glibc_dir, emulator, path,
+                 idle_timeout):
+        self.targets = targets
+        self.recover = recover
+        self.glibc_dir = glibc_dir
+        # runs on the guests record their results under this emulator
+        self.emulator = emulator
+        self.path = path
+        self.idle_timeout = idle_timeout
+        self.leases = {}
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.last_used = time.monotonic()
+        self.recovering = set()
+
+    def _free_targets(self):
+        return [target for target in self.targets
+                if not target.dropped and target.crash is None and
+                target not in self.leases]
+
+    def _lease(self, connection, count):
+        with self.lock:
+            free = self._free_targets()
+            if len(free) < count:
+                return {'error': f'{len(free)} of {len(self.targets)} '
+                                 'guests are free'}
+            for target in free[:count]:
+                self.leases[target] = connection
+            self.last_used = time.monotonic()
+
+        logging.info('leased %s', ', '.join(str(target)
+                                            for target in free[:count]))
+        return {
+            'glibc_dir': self.glibc_dir,
+            'emulator': self.emulator,
+            'targets': [[target.hostname, target.port]
+                        for target in free[:count]]
+        }
+
+    def _release(self, connection):
+        with self.lock:
+            released = [target for target, owner in self.leases.items()
+                        if owner is connection]
+            for target in released:
+                del self.leases[target]
+            self.last_used = time.monotonic()
+
+        if released:
+            logging.info('released %s', ', '.join(str(target)
+                                                  for target in released))
+
+    def _status(self):
+        with self.lock:
+            return {'guests': [{
+                'target': str(target),
+                'leased': target in self.leases,
+                'crash': target.crash,
+                'dropped': target.dropped,
+                'restarts': target.restarts
+            } for target in self.targets]}
+
+    def _handle(self, connection):
+        # leases last as long as the connection of the client
+        try:
+            for line in connection.makefile('rb'):
+                try:
+                    request = json.loads(line)
+                    command = request['command']
+                except (ValueError, KeyError, TypeError):
+                    _send(connection, {'error': 'invalid request'})
+                    continue
+
+                if command == 'lease':
+                    _send(connection,
+                          self._lease(connection, request.get('count', 1)))
+                elif command == 'status':
+                    _send(connection, self._status())
+                elif command == 'stop':
+                    _send(connection, {})
+                    self.stopped.set()
+                else:
+                    _send(connection, {'error': f'unknown command {command}'})
+        except OSError:
+            pass
+        finally:
+            self._release(connection)
+            connection.close()
+
+    def _recover(self, target):
+        try:
+            if not self.recover(target):
+                logging.error('%s: guest is no longer served', target)
+        except Exception as err:
+            # the last guest; the server stops once it is dropped
+            logging.error('%s: guest is no longer served: %s', target, err)
+            target.dropped = True
+            target.stop()
+        finally:
+            with self.lock:
+                self.recovering.discard(target)
+
+    def _check_targets(self):
+        # failed guests are restarted once they are given back; a restart
+        # takes a boot, so it doesn't hold up the leases of the others
+        with self.lock:
+            failed = [target for target in self.targets
+                      if target.crash is not None and not target.dropped and
+                      target not in self.leases and
+                      target not in self.recovering]
+            self.recovering.update(failed)
+        for target in failed:
+            threading.Thread(target=self._recover, args=(target,),
+                             daemon=True).start()
+
+    def _idle(self):
+        with self.lock:
+            return not self.leases and \
+                time.monotonic() - self.last_used > self.idle_timeout
+
+    def serve(self):
+        remove_stale_socket(self.path)
+
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(self.path)
+        # another server may take the path over once this one has exited
+        created = os.stat(self.path)
+        server.listen()
+        server.settimeout(CHECK_INTERVAL)
+        logging.info('serving %d guests on %s', len(self.targets), self.path)
+        try:
+            while not self.stopped.is_set():
+                try:
+                    connection, _ = server.accept()
+                except socket.timeout:
+                    pass
+                else:
+                    threading.Thread(target=self._handle, args=(connection,),
+                                     daemon=True).start()
+
+                self._check_targets()
+                if all(target.dropped for target in self.targets):
+                    raise ServerError('No guests are left')
+                if self._idle():
+                    logging.info('no guests were leased for %d seconds',
+                                  self.idle_timeout)
+                    break
+        finally:
+            server.close()
+            try:
+                current = os.stat(self.path)
+                if (current.st_dev, current.st_ino) == \
+                        (created.st_dev, created.st_ino):
+                    os.unlink(self.path)
+            except FileNotFoundError:
+                pass
+
+
+class GuestLease:
+    def __init__(self, path, count):
+        self.connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            self.connection.connect(path)
+            _send(self.connection, {'command': 'lease', 'count': count})
+            reply = json.loads(self.connection.makefile('rb').readline())
+        except (OSError, ValueError) as err:
+            self.connection.close()
+            raise ServerError(f'Failed to lease guests from {path}: {err}')
+
+        if 'error' in reply:
+            self.connection.close()
+            raise ServerError(f'Failed to lease guests from {path}: '
+                              f'{reply["error"]}')
+
+        self.glibc_dir = reply['glibc_dir']
+        self.emulator = reply.get('emulator')
+        self.targets = [tuple(target) for target in reply['targets']]
+
+    def close(self):
+        self.connection.close()
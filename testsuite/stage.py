@@ -0,0 +1,90 @@
+import os
+import re
+import stat
+import utils
+
+STAGE_DIR = '/tmp/glibc-stage'
+ET_EXEC = 2
+ET_DYN = 3
+LIBRARY_NAME = re.compile(r'\.so(\.[0-9]+)*$')
+# the install tree is a copy of the libraries, tests load them from the
+# build tree
+SKIPPED_DIRS = ('install',)
+
+
+def _relative(path, build_dir):
+    name = os.path.relpath(path, build_dir)
+    if name == os.pardir or name.startswith(os.pardir + os.sep):
+        return None
+    if name.split(os.sep, 1)[0] in SKIPPED_DIRS:
+        return None
+    return name
+
+
+def is_staged(path, build_dir, subdirs=None):
+    name = _relative(path, build_dir)
+    if name is None:
+        return False
+
+    # libraries are staged for every subdir, test programs only for the
+    # subdirs being tested
+    library = LIBRARY_NAME.search(name) is not None
+    subdir = name.split(os.sep, 1)[0] if os.sep in name else '.'
+    if not library and subdirs is not None and subdir not in subdirs:
+        return False
+
+    try:
+        if not os.stat(path).st_mode & stat.S_IXUSR:
+            return False
+    except OSError:
+        return False
+
+    header = utils.elf_header(path)
+    if header is None:
+        return False
+    return header[0] == ET_DYN if library else header[0] in (ET_EXEC, ET_DYN)
+
+
+def iter_staged(build_dir, subdirs=None):
+    for root, dirs, files in os.walk(build_dir):
+        if root == build_dir:
+            dirs[:] = [name for name in dirs if name not in SKIPPED_DIRS]
+        for name in files:
+            path = os.path.join(root, name)
+            if is_staged(path, build_dir, subdirs):
+                yield os.path.relpath(path, build_dir)
+
+
+def _staged_path(path, build_dir, stage, directory):
+    if not os.path.isabs(path):
+        return path
+
+    if directory:
+        name = _relative(path, build_dir) if os.path.isdir(path) else None
+    elif is_staged(path, build_dir, stage['subdirs']):
+        name = os.path.relpath(path, build_dir)
+    else:
+        name = None
+
+    return path if name is None else \
+        os.path.normpath(os.path.join(stage['dir'], name))
+
+
+def _staged_paths(value, build_dir, stage, directory=False):
+    return ':'.join(_staged_path(path, build_dir, stage, directory)
+                    for path in value.split(':'))
+
+
+def stage_args(args, build_dir, stage):
+    staged = []
+    library_path = False
+    for arg in args:
+        if library_path:
+            staged.append(_staged_paths(arg, build_dir, stage, directory=True))
+        elif '=' in arg and not arg.startswith('-'):
+            name, _, value = arg.partition('=')
+            staged.append(f'{name}={_staged_paths(value, build_dir, stage)}')
+        else:
+            staged.append(_staged_paths(arg, build_dir, stage))
+        library_path = arg == '--library-path'
+    return staged
@@ -0,0 +1,59 @@
+import logging
+import os
+import threading
+import time
+
+
+class Target:
+    def __init__(self, hostname, port, emulator=None):
+        self.hostname = hostname
+        self.port = port
+        self.emulator = emulator
+        self.ssh_cmd = None
+        self.ssh_master = None
+        self.test_wrapper = None
+        # None until the tests are staged, False if staging failed
+        self.staged = None
+        self.watchdog = None
+        self.lock = threading.Lock()
+        self.crash = None
+        self.crash_time = None
+        self.crashes = 0
+        self.restarts = 0
+        self.dropped = False
+        # nSIM TAP interface and the host address on it
+        self.tap = None
+        self.server_ip = None
+
+    def __str__(self):
+        return f'{self.hostname}:{self.port}'
+
+    def crashed(self, reason):
+        logging.error('%s: guest failure: %s', self, reason)
+        self.crash = reason
+        self.crash_time = time.time()
+        self.crashes += 1
+        # tests still running on the guest fail at once instead of waiting
+        # for their timeouts
+        if self.emulator is not None:
+            self.emulator.stop()
+
+    def stop(self):
+        if self.watchdog is not None:
+            self.watchdog.stop()
+            self.watchdog = None
+
+        if self.ssh_cmd:
+            os.unlink(self.ssh_cmd)
+            self.ssh_cmd = None
+
+        if self.ssh_master is not None:
+            reused, new = self.ssh_master.connections()
+            logging.info('%s: SSH connections: %d reused, %d new',
+                         self, reused, new)
+            self.ssh_master.stop()
+            self.ssh_master = None
+
+        if self.emulator is not None:
+            self.emulator.stop()
+            self.emulator = None
@@ -0,0 +1,80 @@
+import logging
+import re
+import subprocess
+import threading
+import time
+from emulators.emulator import EmulatorError
+
+# console messages after which the guest can't be trusted to run tests
+FATAL_MESSAGES = re.compile(r'Kernel panic|BUG: soft lockup|'
+                            r'rcu_\w+ (self-)?detected stall')
+# console messages which are reported, the probe decides if the guest is dead
+WARNING_MESSAGES = re.compile(r'Oops|Out of memory: Killed process|'
+                              r'Unable to handle kernel')
+
+
+class Watchdog(threading.Thread):
+    def __init__(self, target, probe_command, interval=30, probe_timeout=60,
+                 probe_failures=3):
+        super().__init__(name=f'watchdog {target}', daemon=True)
+        self.target = target
+        self.probe_command = probe_command
+        self.interval = interval
+        self.probe_timeout = probe_timeout
+        self.probe_failures = probe_failures
+        self.stopped = threading.Event()
+        self.line = ''
+
+    def _probe(self):
+        try:
+            subprocess.run(self.probe_command,
+                           stdin=subprocess.DEVNULL,
+                           stdout=subprocess.DEVNULL,
+                           stderr=subprocess.DEVNULL,
+                           timeout=self.probe_timeout,
+                           check=True)
+            return True
+        except (OSError, subprocess.SubprocessError):
+            return False
+
+    def _check_console(self):
+        emulator = self.target.emulator
+        if emulator is None:
+            self.stopped.wait(1)
+            return None
+
+        try:
+            output = emulator.read_console(timeout=1)
+        except EmulatorError as err:
+            return str(err)
+
+        # a message may be split between two reads
+        lines = (self.line + output).split('\n')
+        self.line = lines.pop()
+        for line in lines:
+            line = line.strip()
+            if FATAL_MESSAGES.search(line):
+                return line
+            if WARNING_MESSAGES.search(line):
+                logging.warning('%s: %s', self.target, line)
+        return None
+
+    def run(self):
+        failures = 0
+        next_probe = time.monotonic() + self.interval
+        while not self.stopped.is_set():
+            reason = self._check_console()
+            if reason is None and time.monotonic() >= next_probe:
+                failures = 0 if self._probe() else failures + 1
+                next_probe = time.monotonic() + self.interval
+                if failures >= self.probe_failures:
+                    reason = f'no response to {failures} SSH probes'
+
+            if reason is not None and not self.stopped.is_set():
+                self.target.crashed(reason)
+                return
+
+    def stop(self):
+        self.stopped.set()
+        if self is not threading.current_thread():
+            self.join()
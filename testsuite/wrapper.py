@@ -0,0 +1,192 @@
+import json
+import os
+import subprocess
+import sys
+import time
+import utils
+from shutil import which
+from testsuite.stage import stage_args
+
+# ld.so options which take a value
+RTLD_OPTIONS = {
+    '--library-path',
+    '--inhibit-rpath',
+    '--audit',
+    '--preload',
+    '--argv0',
+    '--glibc-hwcaps-prepend',
+    '--glibc-hwcaps-mask'
+}
+
+
+def elf_machine(path):
+    header = utils.elf_header(path)
+    return header[1] if header else None
+
+
+class TestCommand:
+    def __init__(self, args, build_dir):
+        self.env = []
+        self.unset = []
+        # test-wrapper-env-only runs the tests with env -i
+        self.ignore_environment = False
+        self.args = list(args)
+
+        if self.args and self.args[0] == 'env':
+            self.args.pop(0)
+            while self.args:
+                arg = self.args[0]
+                if arg in ('-i', '-', '--ignore-environment'):
+                    self.ignore_environment = True
+                    self.args.pop(0)
+                elif arg in ('-u', '--unset') and len(self.args) > 1:
+                    self.unset.append(self.args[1])
+                    del self.args[:2]
+                elif arg.startswith('--unset='):
+                    self.unset.append(self.args.pop(0)[len('--unset='):])
+                elif arg.startswith('-u') and not arg.startswith('--'):
+                    self.unset.append(self.args.pop(0)[2:])
+                elif '=' in arg and not arg.startswith('-'):
+                    self.env.append(self.args.pop(0))
+                elif arg == '--':
+                    self.args.pop(0)
+                    break
+                else:
+                    break
+
+        self.program = self._program()
+        self.name = self._test_name(build_dir)
+
+    def _program(self):
+        if not self.args:
+            return None
+
+        if not os.path.basename(self.args[0]).startswith('ld'):
+            return self.args[0]
+
+        args = iter(self.args[1:])
+        for arg in args:
+            if arg in RTLD_OPTIONS:
+                next(args, None)
+            elif not arg.startswith('--'):
+                return arg
+        return self.args[0]
+
+    def _test_name(self, build_dir):
+        if self.program is None:
+            return ''
+
+        program = os.path.realpath(self.program)
+        if program.startswith(build_dir + os.sep):
+            return os.path.relpath(program, build_dir)
+        return os.path.basename(program)
+
+    def executable(self):
+        if not self.args:
+            return None
+        if os.sep in self.args[0]:
+            return self.args[0]
+        return which(self.args[0])
+
+
+def _timeoutfactor(test, config):
+    if not config.get('timeouts'):
+        return None
+
+    with open(config['timeouts']) as timeouts:
+        return json.load(timeouts).get(test.name)
+
+
+def _fallback(args, config, timeoutfactor=None):
+    stage = config.get('stage')
+    if stage:
+        args = stage_args(args, config['build_dir'], stage)
+
+    fallback = list(config['fallback'])
+    if timeoutfactor is not None and '--timeoutfactor' in fallback:
+        fallback[fallback.index('--timeoutfactor') + 1] = str(timeoutfactor)
+    return fallback + args
+
+
+def _command(test, args, config, timeoutfactor=None):
+    if config['qemu_user'] is None:
+        return _fallback(args, config, timeoutfactor)
+
+    # the emulators import pexpect, which is too slow to load for every test
+    from emulators.qemuuser import QemuUserEmulator
+
+    qemu_user = QemuUserEmulator(**config['qemu_user'])
+    executable = test.executable()
+    machine = elf_machine(executable) if executable else None
+    if machine is None or machine == elf_machine(sys.executable):
+        # host programs (shell scripts, coreutils) run natively
+        command = ['env']
+        if test.ignore_environment:
+            command.append('-i')
+        for name in test.unset:
+            command += ['-u', name]
+        return command + test.env + test.args
+
+    if qemu_user.accepts(test.name):
+        return qemu_user.command(test.args, test.env, test.unset,
+                                 test.ignore_environment)
+
+    if config['fallback']:
+        return _fallback(args, config, timeoutfactor)
+
+    print(f'{test.name}: unsupported by {qemu_user.name()}', file=sys.stderr)
+    return None
+
+
+def record_duration(path, test, duration, exitcode, target=None,
+                    timeoutfactor=None):
+    record = json.dumps({
+        'test': test,
+        'duration': round(duration, 3),
+        'exitcode': exitcode,
+        'end': round(time.time(), 3),
+        'target': target,
+        'timeoutfactor': timeoutfactor
+    }) + '\n'
+
+    # a single O_APPEND write keeps records of parallel tests intact
+    fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(fd, record.encode())
+    finally:
+        os.close(fd)
+
+
+def main():
+    if len(sys.argv) < 2:
+        print(f'usage: {sys.argv[0]} CONFIG COMMAND...', file=sys.stderr)
+        return 2
+
+    with open(sys.argv[1]) as config_file:
+        config = json.load(config_file)
+
+    test = TestCommand(sys.argv[2:], config['build_dir'])
+    if not test.args:
+        return 0
+
+    timeoutfactor = _timeoutfactor(test, config)
+    args = _command(test, sys.argv[2:], config, timeoutfactor)
+    if args is None:
+        return 77
+
+    sys.stdout.flush()
+    if not config.get('durations'):
+        os.execvp(args[0], args)
+
+    start = time.monotonic()
+    exitcode = subprocess.call(args)
+    if exitcode < 0:
+        exitcode = 128 - exitcode
+    record_duration(config['durations'], test.name,
+                    time.monotonic() - start, exitcode, config.get('target'),
+                    timeoutfactor)
+    return exitcode
+
+
+if __name__ == '__main__':
+    sys.exit(main())
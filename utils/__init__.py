@@ -1,4 +1,5 @@
 import fcntl
+import hashlib
 import os
 import socket
 import struct
@@ -28,6 +29,17 @@ def mkdir(path):
     Path(path).mkdir(parents=True, exist_ok=True)
 
 
+def read_list(path):
+    # one entry per line, # starts a comment
+    entries = []
+    with open(path) as list_file:
+        for line in list_file:
+            line = line.split('#', 1)[0].strip()
+            if line:
+                entries.append(line)
+    return entries
+
+
 def find_file(name, path, follow_symlinks=True):
     for root, _, files in os.walk(path, followlinks=follow_symlinks):
         if name in files:
@@ -35,12 +47,47 @@ def find_file(name, path, follow_symlinks=True):
     return None
 
 
+def file_hash(path, block_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def elf_header(path):
+    try:
+        with open(path, 'rb') as elf:
+            header = elf.read(20)
+    except OSError:
+        return None
+
+    if len(header) < 20 or header[:4] != b'\x7fELF':
+        return None
+    byteorder = '<' if header[5] == 1 else '>'
+    # e_type and e_machine
+    return struct.unpack(f'{byteorder}HH', header[16:20])
+
+
+def available_memory():
+    try:
+        with open('/proc/meminfo') as meminfo:
+            for line in meminfo:
+                name, _, value = line.partition(':')
+                if name == 'MemAvailable':
+                    return int(value.split()[0]) * 1024
+    except (OSError, ValueError):
+        pass
+    return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+
+
 def timestamp(timestamp_format='%Y%m%d%H%M%S'):
     return datetime.now().strftime(timestamp_format)
 
 
 def run_command(args,
-                cwd=None, env=None, timeout=None, shell=False, verbose=True):
+                cwd=None, env=None, timeout=None, shell=False, verbose=True,
+                pass_fds=()):
     if env is not None:
         env = dict(os.environ, **env)
 
@@ -52,4 +99,5 @@ def run_command(args,
         env=env,
         timeout=timeout,
         shell=shell,
+        pass_fds=pass_fds,
         check=True)
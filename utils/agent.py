@@ -0,0 +1,128 @@
+import itertools
+import os
+import secrets
+import shlex
+import subprocess
+import threading
+from concurrent.futures import Future, TimeoutError
+from typing import NamedTuple
+
+AGENT_SCRIPT = os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                            'agent.sh')
+
+
+class AgentError(Exception):
+    pass
+
+
+class AgentReply(NamedTuple):
+    exitcode: int
+    stdout: bytes
+    stderr: bytes
+    duration: float
+
+
+def _encode(cmd):
+    # a single line of escapes, which printf of the agent turns back into the
+    # command whatever quotes and newlines it has
+    return ''.join(f'\\{byte:03o}' for byte in cmd.encode())
+
+
+class Agent:
+    def __init__(self, command, timeout=300):
+        self.nonce = secrets.token_hex(8).encode()
+        self.ids = itertools.count()
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.write_lock = threading.Lock()
+        self.ready = Future()
+        self.exited = False
+
+        with open(AGENT_SCRIPT) as script:
+            remote = f'sh -c {shlex.quote(script.read())} agent ' \
+                     f'{self.nonce.decode()}'
+        try:
+            self.process = subprocess.Popen(command + [remote],
+                                            stdin=subprocess.PIPE,
+                                            stdout=subprocess.PIPE,
+                                            stderr=subprocess.PIPE)
+        except OSError as err:
+            raise AgentError(f'Failed to start agent: {err}')
+
+        self.reader = threading.Thread(target=self._read, daemon=True)
+        self.reader.start()
+        try:
+            self.ready.result(timeout)
+        except TimeoutError:
+            self.close()
+            raise AgentError('Agent did not start')
+
+    def _reply(self, fields):
+        stdout = self.process.stdout
+        id_, exitcode, start, end = fields[1:5]
+        stdout_size, stderr_size = int(fields[5]), int(fields[6])
+        reply = AgentReply(int(exitcode), stdout.read(stdout_size),
+                           stdout.read(stderr_size),
+                           round(float(end) - float(start), 2))
+        with self.lock:
+            future = self.pending.pop(int(id_), None)
+        if future is not None:
+            future.set_result(reply)
+
+    def _read(self):
+        for line in self.process.stdout:
+            fields = line.split()
+            # motd and other output of the login are skipped
+            if not fields or fields[0] != self.nonce:
+                continue
+            if fields[1:] == [b'ready']:
+                self.ready.set_result(True)
+            elif len(fields) == 7:
+                self._reply(fields)
+
+        error = self.process.stderr.read().decode(errors='replace').strip()
+        error = AgentError(f'Agent exited: {error}' if error else
+                           'Agent exited')
+        if not self.ready.done():
+            self.ready.set_exception(error)
+        with self.lock:
+            self.exited = True
+            pending, self.pending = self.pending, {}
+        for future in pending.values():
+            future.set_exception(error)
+
+    def submit(self, cmd) -> Future:
+        future = Future()
+        with self.lock:
+            if self.exited:
+                raise AgentError('Agent exited')
+            id_ = next(self.ids)
+            self.pending[id_] = future
+
+        try:
+            with self.write_lock:
+                self.process.stdin.write(f'{id_} {_encode(cmd)}\n'.encode())
+                self.process.stdin.flush()
+        except (OSError, ValueError) as err:
+            with self.lock:
+                self.pending.pop(id_, None)
+            raise AgentError(f'Failed to send command: {err}')
+        return future
+
+    def run(self, cmd, timeout=None) -> AgentReply:
+        try:
+            return self.submit(cmd).result(timeout)
+        except TimeoutError:
+            raise AgentError(f'Command \'{cmd}\' timed out')
+
+    def close(self):
+        try:
+            self.process.stdin.close()
+        except OSError:
+            pass
+        try:
+            self.process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+        self.reader.join()
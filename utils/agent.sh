@@ -0,0 +1,44 @@
+# Runs the commands of requests at the same time and sends a reply for every
+# command when it finishes.
+#
+# request: <id> <command with every byte as a \ooo escape>
+# reply:   <nonce> <id> <exit code> <start> <end> <stdout size> <stderr size>
+#          followed by the stdout and stderr of the command
+# start and end are taken from /proc/uptime.
+
+nonce=$1
+dir=$(mktemp -d /tmp/glibc-agent.XXXXXX) || exit 1
+mkfifo "$dir/replies" || exit 1
+
+# replies are sent one after another by a single writer; the fifo is opened
+# for reading and writing, so that it doesn't see the end of the file while
+# no command is running
+(
+    exec 3<>"$dir/replies"
+    while read -r id <&3; do
+        cat "$dir/$id.reply"
+        rm -f "$dir/$id".*
+    done
+) &
+writer=$!
+exec 4>"$dir/replies"
+
+echo "$nonce ready"
+while read -r id command; do
+    printf "$command" > "$dir/$id.sh"
+    (
+        read -r start _ < /proc/uptime
+        sh "$dir/$id.sh" < /dev/null > "$dir/$id.out" 2> "$dir/$id.err"
+        exitcode=$?
+        read -r end _ < /proc/uptime
+        {
+            echo "$nonce $id $exitcode $start $end" \
+                 $(wc -c < "$dir/$id.out") $(wc -c < "$dir/$id.err")
+            cat "$dir/$id.out" "$dir/$id.err"
+        } > "$dir/$id.reply"
+        echo "$id" >&4
+    ) &
+done
+
+kill $writer
+rm -rf "$dir"
@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+
+import argparse
+import bisect
+import json
+import os
+import re
+import sys
+import threading
+import time
+import zlib
+
+# uncompressed bytes per gzip member
+MEMBER_SIZE = 256 << 10
+# a member is written at least this often, so that the log of a crashed run
+# misses only the last seconds
+FLUSH_INTERVAL = 10
+# compressed size of the log and its previous part together
+MAX_SIZE = 64 << 20
+EVENTS = [
+    ('boot', re.compile(r'Run /\S*init as init process|'
+                        r'Freeing unused kernel')),
+    ('login', re.compile(r'\w+ login:')),
+    ('panic', re.compile(r'Kernel panic')),
+    ('stall', re.compile(r'soft lockup|rcu_\w+ (self-)?detected stall')),
+    ('oops', re.compile(r'Oops|Unable to handle kernel|BUG:')),
+    ('oom', re.compile(r'Out of memory')),
+    ('segfault', re.compile(r'segfault at|Segmentation fault'))
+]
+MAX_LINE = 200
+
+
+def index_path(path):
+    return f'{path}.idx'
+
+
+class ConsoleLog:
+    # a gzip file of independent members, which is read by zcat as a whole,
+    # and an index of events with the offset of the member they are in, so
+    # that only that member is decompressed to find them
+    def __init__(self, path, max_size=MAX_SIZE, member_size=MEMBER_SIZE):
+        self.path = path
+        self.max_size = max_size
+        self.member_size = member_size
+        self.lock = threading.Lock()
+        self.position = 0
+        self.line = ''
+        self.line_position = 0
+        self.closed = False
+        self._open()
+
+    def _open(self):
+        self.file = open(self.path, 'wb')
+        self.index = open(index_path(self.path), 'w')
+        # file offsets and uncompressed positions of the members
+        self.offsets = [0]
+        self.positions = [self.position]
+        self.buffer = []
+        self.flushed = time.monotonic()
+
+    def _rotate(self):
+        self.file.close()
+        self.index.close()
+        previous = f'{self.path}.1'
+        os.replace(self.path, previous)
+        os.replace(index_path(self.path), index_path(previous))
+        self._open()
+
+    def _flush_member(self):
+        self.flushed = time.monotonic()
+        if not self.buffer:
+            return
+
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        data = compressor.compress(b''.join(self.buffer)) + compressor.flush()
+        self.buffer = []
+        self.file.write(data)
+        self.file.flush()
+        self.offsets.append(self.offsets[-1] + len(data))
+        self.positions.append(self.position)
+
+        if self.offsets[-1] >= self.max_size // 2:
+            self._rotate()
+
+    def _record(self, event, position, line):
+        member = max(0, bisect.bisect_right(self.positions, position) - 1)
+        entry = {
+            'event': event,
+            'time': round(time.time(), 3),
+            'member': self.offsets[member],
+            'offset': max(0, position - self.positions[member]),
+            'line': line.strip()[:MAX_LINE]
+        }
+        self.index.write(json.dumps(entry) + '\n')
+        self.index.flush()
+
+    def _scan(self, data):
+        found = False
+        lines = (self.line + data).split('\n')
+        self.line = lines.pop()
+        for line in lines:
+            for event, pattern in EVENTS:
+                if pattern.search(line):
+                    self._record(event, self.line_position, line)
+                    found = True
+                    break
+            self.line_position += len(line.encode('utf-8', 'replace')) + 1
+
+        # a login prompt isn't followed by a new line
+        if not found and EVENTS[1][1].search(self.line):
+            self._record('login', self.line_position, self.line)
+            self.line_position += len(self.line.encode('utf-8', 'replace'))
+            self.line = ''
+            found = True
+        return found
+
+    def write(self, data):
+        with self.lock:
+            if self.closed:
+                return
+            raw = data.encode('utf-8', 'replace')
+            self.buffer.append(raw)
+            self.position += len(raw)
+            # events are written to disk at once, it may be the last output
+            # of the guest
+            if self._scan(data) or \
+                    self.position - self.positions[-1] >= self.member_size or \
+                    time.monotonic() - self.flushed >= FLUSH_INTERVAL:
+                self._flush_member()
+
+    def flush(self):
+        # called by pexpect after every write; members are written when they
+        # are full, have an event, or are old enough
+        pass
+
+    def close(self):
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+            self._flush_member()
+            self.file.close()
+            self.index.close()
+
+
+def read_member(path, offset):
+    # returns the data of the member and the offset of the next one
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    data = b''
+    with open(path, 'rb') as log:
+        log.seek(offset)
+        while not decompressor.eof:
+            chunk = log.read(64 << 10)
+            if not chunk:
+                break
+            offset += len(chunk)
+            data += decompressor.decompress(chunk)
+    return data, offset - len(decompressor.unused_data)
+
+
+def read_index(path):
+    try:
+        with open(index_path(path)) as index:
+            return [json.loads(line) for line in index if line.strip()]
+    except (OSError, ValueError):
+        return []
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='show events of a compressed emulator console log')
+    parser.add_argument('log',
+                        help='console log(.log.gz)')
+
+    parser.add_argument('--event',
+                        choices=[event for event, _ in EVENTS],
+                        help='print the console output from every event '
+                             'of the type')
+
+    lines = 40
+    parser.add_argument('--lines',
+                        type=int,
+                        default=lines,
+                        help=f'lines printed from every event({lines})')
+    args = parser.parse_args()
+
+    for entry in read_index(args.log):
+        if args.event is None:
+            timestamp = time.strftime('%H:%M:%S', time.localtime(entry['time']))
+            print(f'{timestamp} {entry["event"]:<10} {entry["line"]}')
+            continue
+        if entry['event'] != args.event:
+            continue
+
+        # the output of an event may go on in the next members
+        data, offset = read_member(args.log, entry['member'])
+        data = data[entry['offset']:]
+        while data.count(b'\n') < args.lines:
+            member, next_offset = read_member(args.log, offset)
+            if next_offset == offset:
+                break
+            data += member
+            offset = next_offset
+        text = data.decode('utf-8', 'replace')
+        print('\n'.join(text.split('\n')[:args.lines]))
+        print('--')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,21 @@
+import os
+
+
+class Jobserver:
+    # a GNU make jobserver shared by make runs which are started on their
+    # own, so that they don't run more jobs together than the limit
+    def __init__(self, jobs, clients):
+        self.jobs = jobs
+        self.read_fd, self.write_fd = os.pipe()
+        # every make runs one job without a token
+        os.write(self.write_fd, b'+' * max(0, jobs - clients))
+
+    def makeflags(self):
+        return f'-j{self.jobs} --jobserver-auth={self.read_fd},{self.write_fd}'
+
+    def fds(self):
+        return self.read_fd, self.write_fd
+
+    def close(self):
+        os.close(self.read_fd)
+        os.close(self.write_fd)
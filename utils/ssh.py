@@ -1,4 +1,12 @@
-from pexpect import pxssh, ExceptionPexpect
+import logging
+import os
+import shutil
+import subprocess
+import tempfile
+from utils.agent import Agent, AgentError
+from utils.trace import span, traced
+
+DEFAULT_TIMEOUT = 30
 
 
 class SSHConnectionError(Exception):
@@ -6,10 +14,13 @@ class SSHConnectionError(Exception):
 
 
 class SSHConnectionProcessError(SSHConnectionError):
-    def __init__(self, cmd):
+    def __init__(self, cmd, stderr=''):
         self.cmd = cmd
+        self.stderr = stderr
 
     def __str__(self):
+        if self.stderr:
+            return f'Command: \'{self.cmd}\' failed: {self.stderr}'
         return f'Command: \'{self.cmd}\' failed'
 
 
@@ -18,37 +29,112 @@ class SSHConnection:
                  hostname='127.0.0.1',
                  port=None,
                  username='root',
-                 password=None,
                  timeout=300):
-        options = {
-            "StrictHostKeyChecking": "no",
-            "UserKnownHostsFile": "/dev/null"
-        }
+        # commands are run by an agent in the guest, which sends the exit
+        # code and the output of a command in a single reply
+        command = [
+            'ssh',
+            '-o', 'UserKnownHostsFile=/dev/null',
+            '-o', 'StrictHostKeyChecking=no',
+            '-o', 'BatchMode=yes',
+            '-o', f'ConnectTimeout={timeout}',
+            '-p', str(port or 22),
+            f'{username}@{hostname}'
+        ]
         try:
-            self.ssh = pxssh.pxssh(options=options)
-            self.ssh.login(server=hostname,
-                           username=username,
-                           password=password,
-                           login_timeout=timeout,
-                           port=port)
-        except ExceptionPexpect as err:
+            with span('ssh login', 'ssh', host=hostname, port=port):
+                self.agent = Agent(command, timeout)
+        except AgentError as err:
             raise SSHConnectionError(err)
 
     def run(self, cmd, timeout=-1, check=True):
+        with span('ssh run', 'ssh', cmd=cmd):
+            return self._run(cmd, timeout, check)
+
+    def _run(self, cmd, timeout, check):
         try:
-            self.ssh.sendline(cmd)
-            self.ssh.prompt(timeout=timeout)
-            output = self.ssh.before.decode().splitlines()[1:]
-            self.ssh.sendline('echo $?')
-            self.ssh.prompt(timeout=timeout)
-            result = self.ssh.before.decode().strip().splitlines()
-            try:
-                exitcode = int(result[-1])
-            except ValueError:
-                exitcode = 1
-
-            if check and exitcode:
-                raise SSHConnectionProcessError(cmd)
-            return output, exitcode
-        except ExceptionPexpect:
-            raise SSHConnectionProcessError(cmd)
+            reply = self.agent.run(
+                cmd, DEFAULT_TIMEOUT if timeout == -1 else timeout)
+        except AgentError as err:
+            raise SSHConnectionProcessError(cmd, str(err))
+
+        if check and reply.exitcode:
+            raise SSHConnectionProcessError(
+                cmd, reply.stderr.decode(errors='replace').strip())
+        return reply.stdout.decode(errors='replace').splitlines(), \
+            reply.exitcode
+
+    def submit(self, cmd):
+        return self.agent.submit(cmd)
+
+    def close(self):
+        self.agent.close()
+
+
+class SSHMaster:
+    def __init__(self,
+                 hostname='127.0.0.1',
+                 port=22,
+                 username='root',
+                 timeout=300):
+        self.destination = f'{username}@{hostname}'
+        self.port = port
+        self.timeout = timeout
+        self.control_dir = tempfile.mkdtemp(prefix='ssh-master-')
+        self.control_path = os.path.join(self.control_dir, 'control')
+        self.stats_path = os.path.join(self.control_dir, 'connections')
+        self.running = False
+
+    def options(self):
+        return [
+            '-o', 'UserKnownHostsFile=/dev/null',
+            '-o', 'StrictHostKeyChecking=no',
+            '-o', f'ControlPath={self.control_path}',
+            '-p', str(self.port)
+        ]
+
+    @traced('ssh master', 'ssh')
+    def start(self):
+        args = ['ssh'] + self.options() + [
+            '-o', 'ControlMaster=yes',
+            '-o', 'ControlPersist=yes',
+            '-o', f'ConnectTimeout={self.timeout}',
+            '-f', '-N',
+            self.destination
+        ]
+
+        logging.info('starting SSH master connection: %s', ' '.join(args))
+        try:
+            subprocess.run(args,
+                           stdin=subprocess.DEVNULL,
+                           stdout=subprocess.DEVNULL,
+                           stderr=subprocess.DEVNULL,
+                           timeout=self.timeout,
+                           check=True)
+        except (OSError, subprocess.SubprocessError) as err:
+            raise SSHConnectionError(f'Failed to start SSH master: {err}')
+        self.running = True
+
+    def connections(self):
+        reused = new = 0
+        try:
+            with open(self.stats_path) as stats:
+                for line in stats:
+                    if line.strip() == 'reused':
+                        reused += 1
+                    else:
+                        new += 1
+        except FileNotFoundError:
+            pass
+        return reused, new
+
+    def stop(self):
+        if self.running:
+            args = ['ssh'] + self.options() + ['-O', 'exit', self.destination]
+            subprocess.run(args,
+                           stdin=subprocess.DEVNULL,
+                           stdout=subprocess.DEVNULL,
+                           stderr=subprocess.DEVNULL)
+            self.running = False
+
+        shutil.rmtree(self.control_dir, ignore_errors=True)
@@ -0,0 +1,102 @@
+import fcntl
+import ipaddress
+import logging
+import os
+import socket
+import struct
+import subprocess
+from typing import NamedTuple
+
+from utils import get_netmask
+
+SIOCGIFADDR = 0x8915
+TAP_PREFIX = 'nsimtap'
+
+
+class TapError(Exception):
+    pass
+
+
+class Tap(NamedTuple):
+    ifname: str
+    host_ip: str
+    guest_ip: str
+    netmask: str
+
+
+def interface_address(ifname):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        return socket.inet_ntoa(
+            fcntl.ioctl(sock.fileno(), SIOCGIFADDR,
+                        struct.pack('256s', ifname[:15].encode('utf-8')))[20:24])
+    except OSError as err:
+        raise TapError(f'Failed to get IPv4 address of {ifname}: {err}')
+    finally:
+        sock.close()
+
+
+class TapPool:
+    def __init__(self, ifnames, size, create=False):
+        self.ifnames = list(ifnames)
+        self.size = size
+        self.create = create
+        self.created = []
+
+    def _create(self, ifname, index):
+        # every TAP gets its own /24, the guest takes the second address
+        address = f'10.42.{index}.1/24'
+        commands = [
+            ['ip', 'tuntap', 'add', 'dev', ifname, 'mode', 'tap',
+             'user', str(os.getuid())],
+            ['ip', 'addr', 'add', address, 'dev', ifname],
+            ['ip', 'link', 'set', ifname, 'up']
+        ]
+
+        logging.info('creating TAP interface %s with %s', ifname, address)
+        try:
+            for command in commands:
+                subprocess.run(command, stdout=subprocess.DEVNULL,
+                               stderr=subprocess.PIPE, check=True)
+                if command is commands[0]:
+                    self.created.append(ifname)
+        except (OSError, subprocess.CalledProcessError) as err:
+            raise TapError(f'Failed to create TAP interface {ifname}: {err}')
+
+    def _tap(self, ifname):
+        host_ip = interface_address(ifname)
+        netmask = get_netmask(ifname)
+        network = ipaddress.ip_interface(f'{host_ip}/{netmask}').network
+        for address in network.hosts():
+            if str(address) != host_ip:
+                return Tap(ifname, host_ip, str(address), netmask)
+        raise TapError(f'No guest address is left in {network} of {ifname}')
+
+    def setup(self):
+        ifnames = self.ifnames[:self.size]
+        index = 0
+        while len(ifnames) < self.size:
+            if not self.create:
+                raise TapError(f'{self.size} TAP interfaces are needed, '
+                               f'only {len(ifnames)} were given')
+
+            ifname = f'{TAP_PREFIX}{index}'
+            if ifname not in ifnames:
+                # interfaces left by a previous run are reused
+                if not os.path.exists(f'/sys/class/net/{ifname}'):
+                    self._create(ifname, index)
+                ifnames.append(ifname)
+            index += 1
+
+        taps = [self._tap(ifname) for ifname in ifnames]
+        for tap in taps:
+            logging.info('%s: host %s, guest %s/%s', tap.ifname, tap.host_ip,
+                         tap.guest_ip, tap.netmask)
+        return taps
+
+    def stop(self):
+        for ifname in self.created:
+            subprocess.run(['ip', 'link', 'delete', ifname],
+                           stdout=subprocess.DEVNULL,
+                           stderr=subprocess.DEVNULL)
+        self.created = []
@@ -0,0 +1,88 @@
+import functools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+
+class Tracer:
+    def __init__(self):
+        self.events = []
+        self.threads = {}
+        self.lock = threading.Lock()
+        self.origin = time.perf_counter()
+
+    def _timestamp(self, value):
+        return round((value - self.origin) * 1e6)
+
+    def add(self, name, category, start, end, args=None):
+        thread = threading.current_thread()
+        event = {
+            'name': name,
+            'cat': category,
+            'ph': 'X',
+            'ts': self._timestamp(start),
+            'dur': self._timestamp(end) - self._timestamp(start),
+            'pid': os.getpid(),
+            'tid': thread.ident,
+            'args': args or {}
+        }
+        with self.lock:
+            self.events.append(event)
+            self.threads[thread.ident] = thread.name
+
+    @contextmanager
+    def span(self, name, category='suite', **args):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, category, start, time.perf_counter(), args)
+
+    def traced(self, name, category='suite'):
+        def decorator(function):
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                with self.span(name, category):
+                    return function(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def write(self, path):
+        with self.lock:
+            metadata = [{
+                'name': 'thread_name',
+                'ph': 'M',
+                'pid': os.getpid(),
+                'tid': tid,
+                'args': {'name': name}
+            } for tid, name in self.threads.items()]
+            trace = {
+                'traceEvents': metadata + self.events,
+                'displayTimeUnit': 'ms'
+            }
+
+        with open(path, 'w') as trace_file:
+            json.dump(trace, trace_file, separators=(',', ':'))
+
+    def summary(self):
+        phases = {}
+        with self.lock:
+            for event in self.events:
+                count, total, longest = phases.get(event['name'], (0, 0, 0))
+                phases[event['name']] = (count + 1,
+                                         total + event['dur'],
+                                         max(longest, event['dur']))
+
+        lines = [f'{"phase":<24} {"count":>6} {"total":>10} {"max":>10}']
+        for name, (count, total, longest) in sorted(
+                phases.items(), key=lambda phase: phase[1][1], reverse=True):
+            lines.append(f'{name:<24} {count:>6} '
+                         f'{total / 1e6:>9.1f}s {longest / 1e6:>9.1f}s')
+        return lines
+
+
+tracer = Tracer()
+span = tracer.span
+traced = tracer.traced
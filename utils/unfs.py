@@ -4,6 +4,7 @@ import subprocess
 import tempfile
 
 from utils import get_free_port
+from utils.trace import traced
 
 
 class Unfs:
@@ -30,6 +31,7 @@ class Unfs:
 
         os.unlink(self.exports)
 
+    @traced('unfs serve', 'nfs')
     def serve(self):
         nfsport, mountport = get_free_port(udp=True), get_free_port(udp=True)
         args = [
@@ -0,0 +1,56 @@
+import logging
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+
+from utils.trace import traced
+
+
+class VirtiofsdError(Exception):
+    pass
+
+
+class Virtiofsd:
+    def __init__(self, virtiofsd_path, shared_dir):
+        self.virtiofsd = None
+        self.virtiofsd_path = virtiofsd_path
+        self.shared_dir = shared_dir
+        self.socket_dir = tempfile.mkdtemp(prefix='virtiofsd-')
+        self.socket_path = os.path.join(self.socket_dir, 'socket')
+
+    def stop(self):
+        if self.virtiofsd is not None:
+            self.virtiofsd.terminate()
+            self.virtiofsd.wait()
+            self.virtiofsd = None
+
+        shutil.rmtree(self.socket_dir, ignore_errors=True)
+
+    @traced('virtiofsd serve', 'share')
+    def serve(self, timeout=30):
+        args = [
+            self.virtiofsd_path,
+            f'--socket-path={self.socket_path}',
+            f'--shared-dir={self.shared_dir}',
+            '--cache=never',
+            '--sandbox=none'
+        ]
+
+        logging.info('starting virtiofsd with: %s', ' '.join(args))
+        self.virtiofsd = subprocess.Popen(args,
+                                          stdout=subprocess.DEVNULL,
+                                          start_new_session=True)
+
+        # QEMU fails to start if the vhost-user socket doesn't exist yet
+        deadline = time.monotonic() + timeout
+        while not os.path.exists(self.socket_path):
+            if self.virtiofsd.poll() is not None:
+                raise VirtiofsdError('virtiofsd exited with code '
+                                     f'{self.virtiofsd.returncode}')
+            if time.monotonic() > deadline:
+                raise VirtiofsdError('virtiofsd socket was not created')
+            time.sleep(0.1)
+
+        return self.socket_path